@@ -31,6 +31,8 @@ class SupabaseAnalytics:
         self._q = queue.Queue(maxsize=200)
         self._started = False
         self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
         try:
             import certifi
             cafile = certifi.where()
@@ -169,6 +171,12 @@ class SupabaseAnalytics:
                 continue
         return {}
 
+    def _after_fork(self):
+        # The sender thread does not survive fork; the child starts its own on its first event
+        self._q = queue.Queue(maxsize=200)
+        self._started = False
+        self._lock = threading.Lock()
+
     def _start_worker(self):
         if self._started:
             return
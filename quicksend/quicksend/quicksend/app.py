@@ -4,19 +4,39 @@ import webbrowser
 import threading
 import time
 import json
-import difflib
 import subprocess
 import zipfile
 import mimetypes
 import base64
+import bisect
 import hashlib
 import hmac
+import secrets
+import shutil
 from datetime import datetime
-from flask import Flask, render_template, request, send_from_directory, send_file, jsonify, redirect
+from urllib.parse import quote
+from flask import Flask, render_template, request, send_from_directory, send_file, jsonify, redirect, g, Response, stream_with_context
 from werkzeug.utils import secure_filename
+from werkzeug.http import parse_content_range_header
+from werkzeug.exceptions import HTTPException, UnsupportedMediaType, NotFound
+from werkzeug.wsgi import get_input_stream, FileWrapper
+from werkzeug.sansio.multipart import Data, Field, File
 import ctypes
 from ctypes import wintypes
 from analytics import analytics
+from upload_sessions import UploadSessionStore, UploadSessionError
+from ingest import UploadWriter, CountingReader, DecodingReader, PartDecoder, iter_multipart, fsync_dir, supported_encodings, MAX_FIELD_SIZE, READ_SIZE, DURABILITY_MODES
+from blobstore import BlobStore, file_digest, head_tail_digests
+from jobs import JobQueue
+from diskspace import DiskSpaceGuard
+from archive import iter_zip
+from throttle import TransferScheduler
+from authstore import AuthStore
+from fileindex import FileIndex
+from search import TrigramIndex
+from events import EventBus
+from storagelayout import StorageLayout
+from metastore import MetadataStore, SqliteMetadataStore, SECTION_KEYS, CONTAINER_KEYS, is_file_entry
 
 # Fix for Windows Registry MIME type issue
 mimetypes.add_type('application/javascript', '.js')
@@ -467,7 +487,7 @@ def parse_exif_time(date_str):
             continue
     return None
 
-def apply_exif_date(path):
+def apply_exif_date(path, set_time=set_file_time):
     try:
         from PIL import Image
         img = Image.open(path)
@@ -487,7 +507,7 @@ def apply_exif_date(path):
             date_str = exif.get(tag)
             dt = parse_exif_time(date_str)
             if dt:
-                set_file_time(path, dt.timestamp())
+                set_time(path, dt.timestamp())
                 return True
     except Exception as e:
         log(f'[Date] EXIF read failed for {os.path.basename(path)}: {e}')
@@ -514,7 +534,7 @@ def apply_exif_date(path):
                 # Groups are always Y, M, D, H, M, S
                 parts = [int(x) for x in m.groups()]
                 dt = datetime(*parts)
-                set_file_time(path, dt.timestamp())
+                set_time(path, dt.timestamp())
                 log(f'[Date] Restored from filename: {fname} -> {dt}')
                 return True
     except Exception as e:
@@ -534,45 +554,48 @@ try:
 except Exception as e:
     log(f'init metadata error: {e}')
 
-def _read_json(path):
+# Metadata lives in memory for the whole process; saves append the changed entries to a journal
+# that a background thread folds back into metadata.json (see metastore.py)
+# metadata_backend "sqlite" keeps the same model in metadata.db with indexed tables instead
+_METADATA_DB = os.path.splitext(METADATA_FILE)[0] + '.db'
+_metadata_backend = _config.get('metadata_backend') or 'json'
+if _metadata_backend != 'sqlite' and os.path.exists(_METADATA_DB):
+    # Back from SQLite: metadata.db is newer than metadata.json, so it is written back before JSON loads
     try:
-        if os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content:
-                    return {}
-                return json.loads(content)
+        _db_store = SqliteMetadataStore(_METADATA_DB, json_path=METADATA_FILE)
+        _db_store.set_logger(log)
+        _db_store.export_json()
     except Exception as e:
-        log(f'[Metadata] 读取失败 {path}: {e}')
-    return None
+        log(f'[Metadata] 无法将 {_METADATA_DB} 导出到 {METADATA_FILE}, 继续使用 SQLite: {e}')
+        _metadata_backend = 'sqlite'
+if _metadata_backend == 'sqlite':
+    _metadata_store = SqliteMetadataStore(_METADATA_DB, json_path=METADATA_FILE, normalize=lambda d: _ensure_groups(d))
+else:
+    _metadata_store = MetadataStore(METADATA_FILE, normalize=lambda d: _ensure_groups(d))
+_metadata_store.set_logger(log)
 
 def load_metadata():
-    data = _read_json(METADATA_FILE)
-    if data is not None:
-        log(f'[Metadata] 加载成功: {METADATA_FILE}, 共 {len(data)} 条记录')
-        return _ensure_groups(data)
-    log('[Metadata] 未找到 metadata 文件, 使用空记录')
-    return _ensure_groups({})
+    return _metadata_store.snapshot()
+
+def read_metadata():
+    # For routes that never save: no per-entry copies, but the entries must not be modified
+    return _metadata_store.view()
 
 def save_metadata(data):
-    p = METADATA_FILE
-    try:
-        os.makedirs(os.path.dirname(p), exist_ok=True)
-        tmp = p + '.tmp'
-        with open(tmp, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
-        if os.path.exists(p):
-            os.replace(tmp, p)
-        else:
-            os.rename(tmp, p)
-        log(f'[Metadata] 保存成功: {p}, 共 {len(data)} 条记录')
-        return True
+    try:
+        return _metadata_store.commit(data)
     except Exception as e:
-        log(f'[Metadata] 保存失败 {p}: {e}')
+        log(f'[Metadata] 保存失败 {METADATA_FILE}: {e}')
         return False
 
+def update_metadata(fn):
+    # Read-modify-write that can't lose a concurrent change to the same entry; fn must not do slow I/O
+    try:
+        return _metadata_store.update(fn)
+    except Exception as e:
+        log(f'[Metadata] 保存失败 {METADATA_FILE}: {e}')
+        return None
+
 # Ensure groups section and file group_id defaults
 def _ensure_groups(meta: dict) -> dict:
     try:
@@ -596,63 +619,9 @@ def _ensure_groups(meta: dict) -> dict:
         pass
     return meta
 
-def load_users():
-    data = _read_json(USERS_FILE)
-    if data is not None:
-        return data
-    return {}
-
-def save_users(data):
-    p = USERS_FILE
-    try:
-        os.makedirs(os.path.dirname(p), exist_ok=True)
-        tmp = p + '.tmp'
-        with open(tmp, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
-        if os.path.exists(p):
-            os.replace(tmp, p)
-        else:
-            os.rename(tmp, p)
-        return True
-    except Exception:
-        return False
-
-def load_sessions():
-    print(f"DEBUG: Loading sessions from {SESSIONS_FILE}")
-    log(f"DEBUG: Loading sessions from {SESSIONS_FILE}")
-    data = _read_json(SESSIONS_FILE)
-    if data is not None:
-        print(f"DEBUG: Loaded sessions: {data}")
-        log(f"DEBUG: Loaded sessions: {data}")
-        return data
-    print("DEBUG: No sessions found")
-    log("DEBUG: No sessions found")
-    return {}
-
-def save_sessions(data):
-    p = SESSIONS_FILE
-    print(f"DEBUG: Saving sessions to {p}: {data}")
-    log(f"DEBUG: Saving sessions to {p}: {data}")
-    try:
-        os.makedirs(os.path.dirname(p), exist_ok=True)
-        tmp = p + '.tmp'
-        with open(tmp, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
-        if os.path.exists(p):
-            os.replace(tmp, p)
-        else:
-            os.rename(tmp, p)
-        print("DEBUG: Sessions saved successfully")
-        log("DEBUG: Sessions saved successfully")
-        return True
-    except Exception as e:
-        print(f"DEBUG: Failed to save sessions: {e}")
-        log(f"DEBUG: Failed to save sessions: {e}")
-        return False
+# Users and login sessions stay in memory; changes are appended to auth.journal (see authstore.py)
+auth_store = AuthStore(USERS_FILE, SESSIONS_FILE, ttl_seconds=int(float(_config.get('session_ttl_days', 30)) * 24 * 3600))
+auth_store.set_logger(log)
 
 @app.route('/api/select-folder', methods=['POST'])
 def select_folder():
@@ -712,8 +681,6 @@ def select_folder():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-_SESSIONS = load_sessions() # token -> username
-
 @app.route('/api/user/auth', methods=['POST'])
 def user_auth():
     data = request.get_json(silent=True) or {}
@@ -723,34 +690,25 @@ def user_auth():
     if not username or not password:
         return jsonify({'error': 'missing fields'}), 400
         
-    users = load_users()
-    existing_hash = users.get(username)
+    existing_hash = auth_store.get_user_hash(username)
     
     if existing_hash:
         # Login: Verify password
         if _check_password_hash(existing_hash, password):
-            token = str(uuid.uuid4())
-            _SESSIONS[token] = username
-            save_sessions(_SESSIONS)
+            token = auth_store.create_session(username)
             return jsonify({'message': 'login success', 'token': token, 'username': username})
         else:
             return jsonify({'error': 'auth failed', 'message': '密码错误'}), 401
     else:
         # Register: Create new user
-        users[username] = _generate_password_hash(password)
-        save_users(users)
-        token = str(uuid.uuid4())
-        _SESSIONS[token] = username
-        save_sessions(_SESSIONS)
+        auth_store.set_user(username, _generate_password_hash(password))
+        token = auth_store.create_session(username)
         return jsonify({'message': 'registered', 'token': token, 'username': username})
 
 @app.route('/api/user/logout', methods=['POST'])
 def user_logout():
     data = request.get_json(silent=True) or {}
-    token = data.get('token')
-    if token and token in _SESSIONS:
-        del _SESSIONS[token]
-        save_sessions(_SESSIONS)
+    auth_store.end_session(data.get('token'))
     return jsonify({'message': 'logged out'})
 
 @app.route('/api/log', methods=['POST'])
@@ -789,9 +747,9 @@ def client_log():
 @app.route('/api/user/me', methods=['POST'])
 def user_me():
     data = request.get_json(silent=True) or {}
-    token = data.get('token')
-    if token and token in _SESSIONS:
-        return jsonify({'username': _SESSIONS[token]})
+    username = auth_store.session_user(data.get('token'))
+    if username:
+        return jsonify({'username': username})
     return jsonify({'error': 'invalid token'}), 401
 
 @app.route('/api/paths')
@@ -803,7 +761,8 @@ def debug_paths():
         'upload_folder': UPLOAD_FOLDER,
         'metadata_file': METADATA_FILE,
         'metadata_exists': os.path.exists(METADATA_FILE),
-        'metadata_size': (os.path.getsize(METADATA_FILE) if os.path.exists(METADATA_FILE) else 0)
+        'metadata_size': (os.path.getsize(METADATA_FILE) if os.path.exists(METADATA_FILE) else 0),
+        'storage': storage_layout.stats()
     }
     return jsonify(info)
 
@@ -1091,8 +1050,41 @@ def maclogo_png():
         pass
     return ('', 204)
 
+# --- Conditional GET for listings ---
+# Listing ETags come from generation counters, so a poll whose list did not change is answered
+# with 304 before the body is built. The boot id keeps tags from an earlier process from matching.
+_ETAG_BOOT = secrets.token_hex(4)
+
+def _listing_not_modified(name, *versions):
+    raw = json.dumps([name, _ETAG_BOOT, _metadata_store.version, list(versions), app.config['UPLOAD_FOLDER'],
+                      _config.get('mode'), _is_local_request(), request.query_string.decode('latin-1')])
+    etag = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:24]
+    g.listing_etag = etag
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+    return None
+
+@app.after_request
+def _tag_listing(resp):
+    if request.method != 'GET' or resp.status_code != 200:
+        return resp
+    etag = g.get('listing_etag')
+    if etag:
+        resp.set_etag(etag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+    elif g.get('etag_from_body'):
+        # Small bodies whose inputs have no counter: hash the body instead
+        resp.add_etag(weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.make_conditional(request)
+    return resp
+
 @app.route('/api/ip')
 def api_ip():
+    g.etag_from_body = True
     try:
         env_ip = os.environ.get('HOST_IP') or os.environ.get('LAN_IP')
         forwarded_host = request.headers.get('X-Forwarded-Host')
@@ -1184,6 +1176,82 @@ def api_config():
         _config['use_source_date'] = bool(data['use_source_date'])
         changed = True
 
+    if 'streaming_upload' in data:
+        _config['streaming_upload'] = bool(data['streaming_upload'])
+        changed = True
+
+    if 'dedup' in data:
+        _config['dedup'] = bool(data['dedup'])
+        changed = True
+
+    if 'disk_reserve_mb' in data:
+        try:
+            _config['disk_reserve_mb'] = max(0, int(data['disk_reserve_mb']))
+        except Exception:
+            return jsonify({'error': 'invalid disk_reserve_mb'}), 400
+        changed = True
+
+    if 'durability' in data:
+        if data['durability'] not in DURABILITY_MODES:
+            return jsonify({'error': 'invalid durability'}), 400
+        _config['durability'] = data['durability']
+        changed = True
+
+    if 'durability_sync_mb' in data:
+        try:
+            _config['durability_sync_mb'] = max(1, int(data['durability_sync_mb']))
+        except Exception:
+            return jsonify({'error': 'invalid durability_sync_mb'}), 400
+        changed = True
+
+    if 'preallocate' in data:
+        _config['preallocate'] = bool(data['preallocate'])
+        changed = True
+
+    if 'max_decompressed_mb' in data:
+        try:
+            _config['max_decompressed_mb'] = max(0, int(data['max_decompressed_mb']))
+        except Exception:
+            return jsonify({'error': 'invalid max_decompressed_mb'}), 400
+        changed = True
+
+    if 'max_session_mb' in data:
+        try:
+            _config['max_session_mb'] = max(0, int(data['max_session_mb']))
+        except Exception:
+            return jsonify({'error': 'invalid max_session_mb'}), 400
+        changed = True
+
+    if 'unlock_token_ttl' in data:
+        try:
+            _config['unlock_token_ttl'] = max(60, int(data['unlock_token_ttl']))
+        except Exception:
+            return jsonify({'error': 'invalid unlock_token_ttl'}), 400
+        changed = True
+
+    for key in ('bandwidth_global_kbs', 'bandwidth_client_kbs', 'max_transfers_per_client'):
+        if key in data:
+            try:
+                _config[key] = max(0, int(data[key] or 0))
+            except Exception:
+                return jsonify({'error': f'invalid {key}'}), 400
+            changed = True
+
+    if 'client_weights' in data:
+        weights = data['client_weights'] or {}
+        try:
+            _config['client_weights'] = {str(k): max(0.01, float(v)) for k, v in weights.items()}
+        except Exception:
+            return jsonify({'error': 'invalid client_weights'}), 400
+        changed = True
+
+    if 'post_workers' in data:
+        try:
+            _config['post_workers'] = post_jobs.set_workers(int(data['post_workers']))
+        except Exception:
+            return jsonify({'error': 'invalid post_workers'}), 400
+        changed = True
+
         
     # Check for both 'upload_folder' (legacy/backend) and 'upload_dir' (frontend)
     new_path = data.get('upload_folder') or data.get('upload_dir')
@@ -1322,17 +1390,15 @@ def list_zip_contents():
     if not filename:
         return jsonify({'error': 'filename required'}), 400
         
-    meta = load_metadata()
+    meta = read_metadata()
     entry = meta.get(filename, {})
     
     # Check ownership/access logic if needed, but mainly password
-    password_hash = entry.get('password_hash')
-    if password_hash:
-        if not password or not _check_password_hash(password_hash, password):
-             return jsonify({'error': 'password required'}), 403
+    if not _can_access('file', filename, entry.get('password_hash'), password):
+        return jsonify({'error': 'password required'}), 403
 
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    if not os.path.exists(file_path):
+    file_path = _upload_path(filename)
+    if not file_path or not os.path.exists(file_path):
         return jsonify({'error': 'not found'}), 404
         
     try:
@@ -1341,7 +1407,7 @@ def list_zip_contents():
              
         with zipfile.ZipFile(file_path, 'r') as zf:
             files = []
-            for info in zf.infolist():
+            for index, info in enumerate(zf.infolist()):
                 # Decode filename if it's not utf-8 (common issue with zip files created on Windows/CN)
                 # zipfile handles cp437, but for Chinese characters it might be tricky. 
                 # Python 3 zipfile attempts to decode.
@@ -1366,7 +1432,9 @@ def list_zip_contents():
 
                 files.append({
                     'name': fname,
+                    'index': index,
                     'size': info.file_size,
+                    'stored': info.compress_type == zipfile.ZIP_STORED,
                     'date': datetime(*info.date_time).strftime('%Y-%m-%d %H:%M:%S') if info.date_time else ''
                 })
             # Sort by name (directories first maybe?)
@@ -1375,17 +1443,984 @@ def list_zip_contents():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+class _ZipMemberSlice:
+    """Seekable read-only window onto the raw bytes of a stored (uncompressed) ZIP member."""
+
+    def __init__(self, f, start, length):
+        self._f = f
+        self._start = start
+        self._length = length
+        self._pos = 0
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += self._length
+        self._pos = max(0, min(pos, self._length))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        remaining = self._length - self._pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b''
+        self._f.seek(self._start + self._pos)
+        data = self._f.read(size)
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        self._f.close()
+
+def _zip_member_data_offset(f, info):
+    # The local header's name/extra lengths can differ from the central directory's, so read them from it
+    f.seek(info.header_offset)
+    header = f.read(30)
+    if len(header) != 30 or header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile('bad local file header')
+    name_len = int.from_bytes(header[26:28], 'little')
+    extra_len = int.from_bytes(header[28:30], 'little')
+    return info.header_offset + 30 + name_len + extra_len
+
+@app.route('/api/zip/member', methods=['GET', 'POST'])
+def download_zip_member():
+    # One member straight out of a stored archive, so nobody has to fetch a 4 GB zip for a 2 MB document
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or request.values.get('filename')
+    password = data.get('password') or request.values.get('password')
+    member = data.get('name') or request.values.get('name')
+    index = data.get('index', request.values.get('index'))
+    if not filename or (member is None and index is None):
+        return jsonify({'error': 'filename and name or index required'}), 400
+    if _is_protected_name(filename):
+        return jsonify({'error': 'protected'}), 403
+    meta = read_metadata()
+    entry = meta.get(filename, {})
+    if not _can_access('file', filename, entry.get('password_hash'), password):
+        return jsonify({'error': 'password required'}), 403
+    file_path = _upload_path(filename)
+    if not file_path or not os.path.isfile(file_path):
+        return jsonify({'error': 'not found'}), 404
+
+    try:
+        zf = zipfile.ZipFile(file_path, 'r')
+    except (zipfile.BadZipFile, OSError):
+        return jsonify({'error': 'not a zip file'}), 400
+    try:
+        infos = zf.infolist()
+        info = None
+        if member is not None:
+            info = next((i for i in infos if i.filename == member), None)
+        else:
+            try:
+                info = infos[int(index)]
+            except (ValueError, TypeError, IndexError):
+                info = None
+        if info is None:
+            zf.close()
+            return jsonify({'error': 'member not found'}), 404
+        if info.is_dir():
+            zf.close()
+            return jsonify({'error': 'member is a directory'}), 400
+        if info.flag_bits & 0x1:
+            zf.close()
+            return jsonify({'error': 'encrypted member not supported'}), 400
+        st = os.stat(file_path)
+        base_name = info.filename.rstrip('/').rsplit('/', 1)[-1]
+        mimetype = mimetypes.guess_type(base_name)[0] or 'application/octet-stream'
+        is_preview = str(request.values.get('preview', '')).lower() == 'true'
+
+        if info.compress_type == zipfile.ZIP_STORED:
+            # Stored bytes are the file itself: serve them in place, with Range support
+            f = open(file_path, 'rb')
+            try:
+                start = _zip_member_data_offset(f, info)
+            except Exception:
+                f.close()
+                raise
+            zf.close()
+            body = _ZipMemberSlice(f, start, info.file_size)
+            resp = Response(FileWrapper(body), mimetype=mimetype, direct_passthrough=True)
+            resp.content_length = info.file_size
+        else:
+            def _generate():
+                try:
+                    with zf.open(info) as src:
+                        while True:
+                            buf = src.read(READ_SIZE)
+                            if not buf:
+                                break
+                            yield buf
+                finally:
+                    zf.close()
+            resp = Response(_generate(), mimetype=mimetype, direct_passthrough=True)
+            resp.content_length = info.file_size
+            resp.headers['Accept-Ranges'] = 'none'
+    except Exception as e:
+        zf.close()
+        log(f'[压缩包] 读取成员失败: {filename}: {e}')
+        return jsonify({'error': 'failed to read archive'}), 500
+
+    resp.headers['Content-Disposition'] = f"{'inline' if is_preview else 'attachment'}; filename*=UTF-8''{quote(base_name)}"
+    archive_tag = _entry_digest(entry, st) or f'{st.st_size}-{getattr(st, "st_mtime_ns", int(st.st_mtime * 1e9))}'
+    resp.set_etag(f'{archive_tag}-{infos.index(info)}')
+    resp.last_modified = st.st_mtime
+    if info.compress_type == zipfile.ZIP_STORED:
+        resp.make_conditional(request.environ, accept_ranges=True, complete_length=info.file_size)
+    else:
+        resp.make_conditional(request.environ)
+    return resp
+
+INTERNAL_DIR_NAME = '.quicksend'
+
+def _is_protected_name(filename):
+    name = (filename or '').replace('\\', '/')
+    if name.lower() == os.path.basename(METADATA_FILE).lower():
+        return True
+    return name.split('/', 1)[0] == INTERNAL_DIR_NAME
+
+# storage_layout "sharded" stores files in hash-prefixed subfolders of .quicksend/files so no directory grows huge;
+# names stay flat in metadata and URLs, and _upload_path is the only place that knows where a file really is
+storage_layout = StorageLayout(lambda: app.config['UPLOAD_FOLDER'], layout=_config.get('storage_layout') or 'flat', skip=_is_protected_name)
+storage_layout.set_logger(log)
+
+def _upload_path(filename):
+    # None for names that cannot be a stored file (separators, '..')
+    return storage_layout.path(filename)
+
+def _send_upload(filename, **kwargs):
+    path = _upload_path(filename)
+    if not path:
+        raise NotFound()
+    return send_from_directory(os.path.dirname(path), os.path.basename(path), **kwargs)
+
+# Optional content-addressed storage: identical uploads share one blob through hard links
+blob_store = BlobStore(lambda: os.path.join(app.config['UPLOAD_FOLDER'], INTERNAL_DIR_NAME, 'blobs'))
+blob_store.set_logger(log)
+
+def _clean_upload_name(raw_name):
+    base_name = os.path.basename(raw_name or '')
+    base_name = ''.join(ch for ch in base_name if ch not in '\\/:*?"<>|')
+    filename = base_name.strip()
+    if not filename or filename in ('.','..'):
+        b, e = os.path.splitext(base_name)
+        ts = str(int(time.time()*1000))
+        safe_base = (b or 'file_' + ts).strip() or ('file_' + ts)
+        safe_ext = e.replace('.', '')
+        filename = safe_base + (('.' + safe_ext) if safe_ext else '')
+    return filename
+
+def _upload_name_taken(name):
+    return name in _PUBLISHING or storage_layout.exists(name)
+
+def _unique_upload_path(filename):
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    if _upload_name_taken(filename):
+        b, e = os.path.splitext(filename)
+        ts = str(int(time.time() * 1000))
+        candidate = f"{b}_{ts}{e}"
+        while _upload_name_taken(candidate):
+            ts = str(int(time.time() * 1000))
+            candidate = f"{b}_{ts}{e}"
+        filename = candidate
+    return filename, storage_layout.target(filename)
+
+def _register_upload(meta, filename, save_path, uploader, group_id, password='', password_hash=None, digest=None, path=None):
+    # path: where the file still is (same inode as save_path once renamed); defaults to save_path
+    path = path or save_path
+    if password:
+        password_hash = _generate_password_hash(password)
+    log(f'[上传] 文件: {filename}, 保存路径: {save_path}, 账号: "{uploader}", 密码: {"已设置" if password_hash else "未设置"}')
+    entry = {'uploader': uploader, 'password_hash': password_hash, 'group_id': group_id}
+    try:
+        digest = digest or file_digest(path)
+    except Exception as e:
+        digest = None
+        log(f'[校验] 计算哈希失败: {filename}: {e}')
+    if digest and _config.get('dedup'):
+        try:
+            # Linked files share the blob's inode (and mtime), so keep this upload's own time in metadata
+            mtime = os.path.getmtime(path)
+            if blob_store.ingest(path, digest):
+                entry['blob'] = digest
+                entry['mtime'] = mtime
+        except Exception as e:
+            log(f'[去重] 处理失败: {filename}: {e}')
+    if digest:
+        _stamp_digest(entry, path, digest)
+    meta[filename] = entry
+    return entry
+
+def _stamp_digest(entry, path, digest):
+    # The size/mtime stamp lets readers tell whether the stored hash still describes the file on disk
+    st = os.stat(path)
+    entry['sha256'] = digest
+    entry['sha256_stat'] = [st.st_size, getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))]
+
+def _entry_digest(entry, st):
+    digest = entry.get('sha256')
+    stamp = entry.get('sha256_stat')
+    if not digest or not isinstance(stamp, list) or len(stamp) != 2:
+        return None
+    if stamp[0] != st.st_size or stamp[1] != getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9)):
+        return None
+    return digest
+
+def _digest_headers(resp, digest):
+    b64 = base64.b64encode(bytes.fromhex(digest)).decode('ascii')
+    resp.headers['Digest'] = f'sha-256={b64}'
+    resp.headers['Repr-Digest'] = f'sha-256=:{b64}:'
+    return resp
+
+# Listings are served from an in-memory index of the upload folder instead of a stat per file per request
+file_index = FileIndex(lambda: app.config['UPLOAD_FOLDER'], rescan_interval=float(_config.get('index_rescan_seconds', 60)), layout=storage_layout)
+file_index.set_logger(log)
+# ?q= searches a trigram index that follows the folder index, instead of scoring every name with difflib
+search_index = TrigramIndex()
+file_index.add_listener(search_index.update)
+
+# --- Background threads ---
+# Watchers start in the process that serves requests, not at import: gunicorn imports the app in its master and
+# forks the worker, and threads do not survive a fork. Objects that did start threads re-spawn them in a forked child.
+_BACKGROUND_PID = None
+_BACKGROUND_LOCK = threading.Lock()
+
+def _start_background():
+    global _BACKGROUND_PID
+    if _BACKGROUND_PID == os.getpid():
+        return
+    with _BACKGROUND_LOCK:
+        if _BACKGROUND_PID == os.getpid():
+            return
+        file_index.start()
+        # Files left in the other layout (an existing flat folder, or files copied straight into it) move in the background
+        if storage_layout.sharded or os.path.isdir(storage_layout.shard_root()):
+            storage_layout.start_migration(file_index.refresh, interval=float(_config.get('storage_migrate_seconds', 300)))
+        _BACKGROUND_PID = os.getpid()
+
+@app.before_request
+def _ensure_background():
+    _start_background()
+
+# --- Change feed ---
+# File, text and group changes are published here so clients can follow /api/events instead of polling the lists
+event_bus = EventBus(capacity=int(_config.get('event_buffer', 2000)))
+event_bus.set_logger(log)
+_EVENT_BULK_LIMIT = 100
+
+def _file_group(name):
+    entry = _metadata_store.peek(name)
+    return (entry.get('group_id') or 'root') if isinstance(entry, dict) else 'root'
+
+# An upload shows up in the folder index before its metadata is saved, and without the entry its group (perhaps a
+# hidden one) is unknown. Its creation event waits for the metadata commit, or _EVENT_CREATE_GRACE seconds for files
+# that never get an entry, such as ones copied straight into the folder.
+_EVENT_CREATE_GRACE = 10
+_PENDING_CREATED = {}
+_PENDING_LOCK = threading.Lock()
+_PENDING_TIMER = None
+
+def _defer_created(name):
+    global _PENDING_TIMER
+    with _PENDING_LOCK:
+        _PENDING_CREATED[name] = time.monotonic() + _EVENT_CREATE_GRACE
+        if _PENDING_TIMER is None:
+            _PENDING_TIMER = threading.Timer(_EVENT_CREATE_GRACE, _flush_created)
+            _PENDING_TIMER.daemon = True
+            _PENDING_TIMER.start()
+
+def _flush_created():
+    global _PENDING_TIMER
+    now = time.monotonic()
+    with _PENDING_LOCK:
+        due = [n for n, deadline in _PENDING_CREATED.items() if deadline <= now]
+        for name in due:
+            del _PENDING_CREATED[name]
+        _PENDING_TIMER = None
+        if _PENDING_CREATED:
+            wait = max(0.1, min(_PENDING_CREATED.values()) - now)
+            _PENDING_TIMER = threading.Timer(wait, _flush_created)
+            _PENDING_TIMER.daemon = True
+            _PENDING_TIMER.start()
+    for name in due:
+        event_bus.publish('file', 'created', name, group_id=_file_group(name))
+
+def _take_pending_created(name):
+    with _PENDING_LOCK:
+        return _PENDING_CREATED.pop(name, None) is not None
+
+def _publish_file_changes(added, removed):
+    if len(added) + len(removed) > _EVENT_BULK_LIMIT:
+        # A rescan or folder switch: one reload beats thousands of single events
+        event_bus.publish('file', 'reset', None)
+        return
+    for name in removed:
+        # Nobody was told about a file whose creation was still pending
+        if not _take_pending_created(name):
+            event_bus.publish('file', 'deleted', name, group_id=_file_group(name))
+    for name in added:
+        if isinstance(_metadata_store.peek(name), dict):
+            event_bus.publish('file', 'created', name, group_id=_file_group(name))
+        else:
+            _defer_created(name)
+
+def _publish_metadata_changes(records, before, after):
+    for sets, dels in records:
+        for path, value in sets:
+            key = path[0]
+            if key in CONTAINER_KEYS:
+                kind = 'group' if key == '__groups__' else 'text'
+                old = before.get(key) if isinstance(before.get(key), dict) else {}
+                if len(path) == 2:
+                    changed = {path[1]: value}
+                else:
+                    changed = {rid: rec for rid, rec in (value or {}).items() if old.get(rid) != rec}
+                    for rid in old:
+                        if rid not in (value or {}):
+                            event_bus.publish(kind, 'deleted', rid)
+                for rid in changed:
+                    event_bus.publish(kind, 'updated' if rid in old else 'created', rid)
+            elif is_file_entry(key, value):
+                if _take_pending_created(key):
+                    event_bus.publish('file', 'created', key, group_id=value.get('group_id') or 'root')
+                elif file_index.get(key) is not None:
+                    event_bus.publish('file', 'updated', key, group_id=value.get('group_id') or 'root')
+                # Otherwise the entry was committed ahead of its file, whose arrival in the index publishes the creation
+        for path in dels:
+            # Removed file entries need no event: the file leaving the folder already produced one
+            if len(path) == 2 and path[0] in CONTAINER_KEYS:
+                event_bus.publish('group' if path[0] == '__groups__' else 'text', 'deleted', path[1])
+
+file_index.add_listener(_publish_file_changes, replay=False)
+_metadata_store.add_listener(_publish_metadata_changes)
+
+def _event_visible(event, local, hidden_ids, oneway):
+    if local:
+        return True
+    if oneway and event['type'] in ('file', 'text'):
+        return False
+    if event['type'] == 'file' and event.get('group_id') in hidden_ids:
+        return False
+    if event['type'] == 'group' and event['id'] in hidden_ids:
+        return False
+    return True
+
+def _event_filter(local):
+    # Remote clients only hear about what the list endpoints would show them
+    oneway = _config.get('mode') == 'oneway'
+    groups = _metadata_store.peek('__groups__') or {}
+    hidden_ids = {gid for gid, grp in groups.items() if isinstance(grp, dict) and grp.get('hidden')}
+    return lambda e: _event_visible(e, local, hidden_ids, oneway)
+
+def _event_stream_limit():
+    limit = _config.get('max_event_streams')
+    if limit is None:
+        # Every open stream holds a server thread; leave at least half the pool for everything else
+        limit = int(os.environ.get('QUICKSEND_THREADS') or 32) // 2
+    return max(0, int(limit))
+
+def _event_json(event):
+    return dict(event, seq=event_bus.event_id(event['seq']))
+
+def _sse(event):
+    payload = {k: v for k, v in _event_json(event).items() if k != 'ts'}
+    return f"id: {payload['seq']}\nevent: {event['type']}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.route('/api/events')
+def api_events():
+    # Ids are "<boot>-<seq>"; one from before a restart (or a bare number) gets a reset, i.e. a full reload
+    raw = request.args.get('since') or request.headers.get('Last-Event-ID')
+    try:
+        since = event_bus.parse_id(raw) if raw not in (None, '') else None
+    except ValueError:
+        return jsonify({'error': 'invalid since'}), 400
+    local = _is_local_request()
+    visible = _event_filter(local)
+
+    if 'text/event-stream' not in (request.headers.get('Accept') or ''):
+        # Long-poll fallback: returns as soon as something newer than `since` exists
+        if since is None:
+            return jsonify({'events': [], 'seq': event_bus.event_id(event_bus.seq), 'reset': False})
+        try:
+            timeout = min(60.0, max(0.0, float(request.args.get('timeout', 25))))
+        except ValueError:
+            return jsonify({'error': 'invalid timeout'}), 400
+        # A waiting poll holds a server thread just like a stream, so it counts against the same cap;
+        # over it, the poll answers with what is pending right away
+        held = timeout > 0 and event_bus.open_stream(_event_stream_limit())
+        try:
+            events, reset = event_bus.wait(since, timeout if held else 0)
+        finally:
+            if held:
+                event_bus.close_stream()
+        seq = event_bus.seq if reset else (events[-1]['seq'] if events else since)
+        resp = jsonify({'events': [_event_json(e) for e in events if visible(e)], 'seq': event_bus.event_id(seq), 'reset': reset})
+        if timeout > 0 and not held:
+            resp.headers['Retry-After'] = '10'
+        return resp
+
+    retry_ms = 3000
+    if not event_bus.open_stream(_event_stream_limit()):
+        # Out of stream slots: hand over what is pending and let EventSource come back later
+        def _drain():
+            events, reset = event_bus.since(since if since is not None else event_bus.seq)
+            yield 'retry: 10000\n\n'
+            if reset:
+                yield f"id: {event_bus.event_id(event_bus.seq)}\nevent: reset\ndata: {{}}\n\n"
+            else:
+                for e in events:
+                    if visible(e):
+                        yield _sse(e)
+        return Response(_drain(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    def _stream():
+        try:
+            seq = since if since is not None else event_bus.seq
+            yield f'retry: {retry_ms}\n\n'
+            if since is None:
+                yield f"id: {event_bus.event_id(seq)}\nevent: hello\ndata: {json.dumps({'seq': event_bus.event_id(seq)})}\n\n"
+            while True:
+                events, reset = event_bus.wait(seq, 15)
+                if reset:
+                    seq = event_bus.seq
+                    yield f"id: {event_bus.event_id(seq)}\nevent: reset\ndata: {{}}\n\n"
+                    continue
+                if not events:
+                    yield ': keepalive\n\n'
+                    continue
+                # Re-read hidden groups each time: a group hidden mid-stream must stop showing up
+                visible = _event_filter(local)
+                for e in events:
+                    seq = e['seq']
+                    if visible(e):
+                        yield _sse(e)
+        finally:
+            event_bus.close_stream()
+    return Response(_stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/events/stats')
+def api_events_stats():
+    if not _is_local_request():
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(event_bus.stats())
+
+# Post-upload hooks (EXIF date restore) run on a worker pool so responses return once the bytes are on disk
+post_jobs = JobQueue(workers=_config.get('post_workers'))
+post_jobs.set_logger(log)
+
+def _post_process_upload(filename, save_path):
+    changed = False
+    restored = []
+    if _config.get('use_source_date'):
+        try:
+            linked = os.stat(save_path).st_nlink > 1
+        except OSError:
+            linked = False
+        if linked:
+            # Deduped names share one inode: setting its time would move every other name's time and stale
+            # their hash stamps, so only this entry's metadata time takes the restored date
+            changed = apply_exif_date(save_path, set_time=lambda path, ts: restored.append(ts))
+        else:
+            changed = apply_exif_date(save_path)
+    if changed:
+        # The file time moved, so refresh the hash stamp (and the stored upload time for deduped links)
+        def _refresh(meta):
+            entry = meta.get(filename)
+            if isinstance(entry, dict):
+                if restored:
+                    entry['mtime'] = restored[0]
+                else:
+                    if entry.get('sha256'):
+                        _stamp_digest(entry, save_path, entry['sha256'])
+                    if entry.get('mtime'):
+                        entry['mtime'] = os.path.getmtime(save_path)
+                meta[filename] = entry
+        update_metadata(_refresh)
+        file_index.refresh(filename)
+    return {'filename': filename, 'date_restored': bool(changed)}
+
+def _schedule_post_upload(saved_paths):
+    if not _config.get('use_source_date'):
+        return []
+    return [post_jobs.submit('post_upload', _post_process_upload, filename, path) for filename, path in saved_paths]
+
+def _upload_created(saved, jobs, **extra):
+    body = {'message': 'ok', 'saved': saved}
+    if jobs:
+        body['jobs'] = jobs
+    body.update(extra)
+    return jsonify(body), 201
+
+def _durability():
+    mode = _config.get('durability', 'none')
+    return mode if mode in DURABILITY_MODES else 'none'
+
+# Uploads are written under .quicksend/incoming and only take their visible name in _publish_uploads, once their
+# metadata (password, group) is committed, so a file is never listed or served half-received or unprotected
+_PUBLISH_LOCK = threading.Lock()
+_PUBLISHING = set()
+_INCOMING_MAX_AGE = 24 * 3600
+
+def _incoming_dir():
+    return os.path.join(app.config['UPLOAD_FOLDER'], INTERNAL_DIR_NAME, 'incoming')
+
+def _open_upload_writer(filename, expected_size=None):
+    if not _config.get('preallocate', True):
+        expected_size = None
+    sync_every = int(_config.get('durability_sync_mb', 64)) * 1024 * 1024
+    incoming = _incoming_dir()
+    os.makedirs(incoming, exist_ok=True)
+    # Bytes on disk no longer need the request's reservation: keeping both would count them twice
+    token = g.get('disk_reservation')
+    on_allocate = (lambda n: disk_guard.consume(token, n)) if token else None
+    while True:
+        tmp_path = os.path.join(incoming, secrets.token_hex(16) + '.part')
+        try:
+            return filename, UploadWriter(tmp_path, hash_name='sha256', expected_size=expected_size, durability=_durability(), sync_every=sync_every, on_allocate=on_allocate)
+        except FileExistsError:
+            continue
+
+def _publish_uploads(meta, uploads, uploader, group_id, password='', password_hash=None, adjust=None):
+    # uploads: [(filename, path, digest)] for finished files outside the folder. Free names are claimed under one lock
+    # (so two uploads never take the same one), every entry is committed, and only then are the files renamed into place.
+    claimed = []
+    try:
+        for filename, path, digest in uploads:
+            with _PUBLISH_LOCK:
+                filename, save_path = _unique_upload_path(filename)
+                _PUBLISHING.add(filename)
+            claimed.append((filename, path, save_path))
+            entry = _register_upload(meta, filename, save_path, uploader, group_id, password=password, password_hash=password_hash, digest=digest, path=path)
+            if adjust:
+                adjust(entry)
+        if save_metadata(meta) is False:
+            raise RuntimeError('metadata not saved')
+        moved = 0
+        try:
+            for filename, path, save_path in claimed:
+                os.replace(path, save_path)
+                moved += 1
+                file_index.refresh(filename)
+            if _durability() != 'none':
+                # The data was synced on close; the renames still have to reach the disk
+                for d in {os.path.dirname(save_path) for _, _, save_path in claimed}:
+                    fsync_dir(d)
+        except Exception:
+            stale = [filename for filename, _, _ in claimed[moved:]]
+            update_metadata(lambda m: [m.pop(f, None) for f in stale])
+            raise
+    finally:
+        with _PUBLISH_LOCK:
+            for filename, _, _ in claimed:
+                _PUBLISHING.discard(filename)
+    return [(filename, save_path) for filename, _, save_path in claimed]
+
+def _sweep_incoming():
+    # Leftovers of uploads cut off by a crash or restart
+    try:
+        with os.scandir(_incoming_dir()) as it:
+            for de in it:
+                try:
+                    if de.name.endswith('.part') and time.time() - de.stat().st_mtime > _INCOMING_MAX_AGE:
+                        os.remove(de.path)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+
+_sweep_incoming()
+
+def _stream_size(stream):
+    # Size of an already-spooled upload part, if its stream can tell
+    try:
+        pos = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        end = stream.tell()
+        stream.seek(pos)
+        return end - pos
+    except Exception:
+        return None
+
+def _register_streamed_uploads(received, uploader, password, group_id):
+    meta = load_metadata()
+    total_bytes = sum(writer.size for _, writer in received)
+    published = _publish_uploads(meta, [(filename, writer.path, writer.hexdigest()) for filename, writer in received], uploader, group_id, password=password)
+    saved = [filename for filename, _ in published]
+    log(f'[上传] Metadata 已保存: {len(saved)} 个条目')
+    track_event('file_upload', {'status': 'success', 'file_count': len(saved), 'total_bytes': total_bytes})
+    return saved, _schedule_post_upload(published)
+
+def _streaming_multipart_upload():
+    # Parse the multipart body as it arrives and write file parts straight into the upload folder,
+    # instead of letting Werkzeug spool each part to a temp file that file.save() then copies again.
+    boundary = (request.mimetype_params.get('boundary') or '').encode('latin-1', 'ignore')
+    if not boundary:
+        return jsonify({'error': 'No file part'}), 400
+    log(f'[上传] 使用上传文件夹(流式): {app.config["UPLOAD_FOLDER"]}')
+    fields = {}
+    received = []
+    saw_file_part = False
+    writer = None
+    filename = None
+    field_name = None
+    field_buf = []
+    decoder = None
+    body = CountingReader(request.stream)
+    try:
+        for event in iter_multipart(body, boundary):
+            if isinstance(event, Field):
+                field_name, field_buf = event.name, []
+            elif isinstance(event, File):
+                field_name = None
+                if event.name == 'file':
+                    saw_file_part = True
+                    if event.filename:
+                        part_encoding = (event.headers.get('Content-Encoding') or '').strip().lower()
+                        if part_encoding in ('', 'identity'):
+                            part_encoding = None
+                        elif part_encoding not in supported_encodings():
+                            raise UnsupportedMediaType(f'unsupported part encoding: {part_encoding}')
+                        # Part sizes aren't known up front; the rest of the body (plus what is buffered) bounds this one
+                        expected = request.content_length - body.count + READ_SIZE if request.content_length and not part_encoding else None
+                        filename, writer = _open_upload_writer(_clean_upload_name(event.filename), expected_size=expected)
+                        decoder = PartDecoder(part_encoding, writer.write, limit=_decompressed_limit()) if part_encoding else None
+            elif isinstance(event, Data):
+                if writer is not None:
+                    if decoder is not None:
+                        decoder.feed(event.data)
+                    else:
+                        writer.write(event.data)
+                    if not event.more_data:
+                        if decoder is not None:
+                            decoder.close()
+                            decoder = None
+                        writer.close()
+                        received.append((filename, writer))
+                        writer = None
+                elif field_name is not None:
+                    field_buf.append(event.data)
+                    if sum(len(b) for b in field_buf) > MAX_FIELD_SIZE:
+                        raise ValueError(f'form field too large: {field_name}')
+                    if not event.more_data:
+                        fields.setdefault(field_name, b''.join(field_buf).decode('utf-8', 'replace'))
+                        field_name = None
+    except HTTPException as e:
+        # Undecodable, over-limit or unsupported compressed data: a client error, not a server one
+        for _, w in received + ([(filename, writer)] if writer is not None else []):
+            w.abort()
+        log(f'[上传] 流式上传被拒绝: {e.code} {e.description}')
+        return jsonify({'error': e.description}), e.code
+    except Exception as e:
+        for _, w in received + ([(filename, writer)] if writer is not None else []):
+            w.abort()
+        log(f'[上传] 流式上传失败: {e}')
+        track_event('file_upload', {'status': 'fail', 'file_count': 0, 'total_bytes': sum(w.size for _, w in received), 'error': str(e)[:200]})
+        return jsonify({'error': 'upload failed'}), 500
+    if not saw_file_part:
+        return jsonify({'error': 'No file part'}), 400
+    if not received:
+        return jsonify({'error': 'No selected file'}), 400
+    group_id = (fields.get('group_id') or 'root').strip() or 'root'
+    try:
+        saved, jobs = _register_streamed_uploads(received, fields.get('uploader', ''), fields.get('password', ''), group_id)
+    except Exception as e:
+        track_event('file_upload', {'status': 'fail', 'file_count': len(received), 'error': str(e)[:200]})
+        return jsonify({'error': 'upload failed'}), 500
+    return _upload_created(saved, jobs)
+
+@app.route('/api/files/<path:filename>', methods=['PUT'])
+def put_file_raw(filename):
+    uploader = request.args.get('uploader') or request.headers.get('X-Uploader') or ''
+    password = request.args.get('password') or request.headers.get('X-Upload-Password') or ''
+    group_id = (request.args.get('group_id') or request.headers.get('X-Group-Id') or 'root').strip() or 'root'
+    filename, writer = _open_upload_writer(_clean_upload_name(filename), expected_size=request.content_length)
+    try:
+        writer.copy_from(request.stream)
+        writer.close()
+    except HTTPException as e:
+        writer.abort()
+        log(f'[上传] 流式上传被拒绝: {filename}: {e.code} {e.description}')
+        return jsonify({'error': e.description}), e.code
+    except Exception as e:
+        writer.abort()
+        log(f'[上传] 流式上传失败: {filename}: {e}')
+        track_event('file_upload', {'status': 'fail', 'file_count': 0, 'total_bytes': writer.size, 'error': str(e)[:200]})
+        return jsonify({'error': 'upload failed'}), 500
+    try:
+        saved, jobs = _register_streamed_uploads([(filename, writer)], uploader, password, group_id)
+    except Exception as e:
+        track_event('file_upload', {'status': 'fail', 'file_count': 1, 'error': str(e)[:200]})
+        return jsonify({'error': 'upload failed'}), 500
+    return _upload_created(saved, jobs)
+
+# --- "Already have it" negotiation ---
+_DIGEST_CACHE = {}
+_DIGEST_CACHE_MAX = 4096
+
+def _cached_file_digest(path, st):
+    key = (path, st.st_size, getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9)))
+    digest = _DIGEST_CACHE.get(key)
+    if digest is None:
+        digest = file_digest(path)
+        if len(_DIGEST_CACHE) >= _DIGEST_CACHE_MAX:
+            _DIGEST_CACHE.clear()
+        _DIGEST_CACHE[key] = digest
+    return digest
+
+def _find_identical_file(meta, size, digest=None, head=None, tail=None, chunk_size=1024 * 1024):
+    # Password-protected and hidden-group files are never offered: knowing a hash must not be a way to read them
+    upload_folder = app.config['UPLOAD_FOLDER']
+    hidden_ids = {gid for gid, grp in meta.get('__groups__', {}).items() if grp.get('hidden')}
+    if not os.path.isdir(upload_folder):
+        return None, None
+    # Sizes come from the folder index, so only same-size files are ever opened
+    for name, st in file_index.items():
+        try:
+            if st.st_size != size or _is_protected_name(name):
+                continue
+            entry = meta.get(name, {})
+            if entry.get('password_hash') or (entry.get('group_id') or 'root') in hidden_ids:
+                continue
+            path = _upload_path(name)
+            if not path:
+                continue
+            if digest:
+                known = _entry_digest(entry, st) or entry.get('blob') or _cached_file_digest(path, st)
+                if known == digest:
+                    return path, entry
+            elif head and tail:
+                if head_tail_digests(path, size, chunk_size) == (head, tail):
+                    return path, entry
+        except Exception as e:
+            log(f'[秒传] 比对失败: {name}: {e}')
+    return None, None
+
+# digest -> names whose entry links to that blob, kept in step with every metadata commit, so the pre-upload
+# check only looks at the few entries sharing the content instead of scanning all of them
+_BLOB_NAMES = {}
+_BLOB_OF = {}
+_BLOB_INDEX_LOCK = threading.Lock()
+_BLOB_INDEX_READY = False
+
+def _index_blob_entry(name, entry):
+    old = _BLOB_OF.pop(name, None)
+    if old is not None:
+        names = _BLOB_NAMES.get(old)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del _BLOB_NAMES[old]
+    digest = entry.get('blob') if is_file_entry(name, entry) else None
+    if digest:
+        _BLOB_OF[name] = digest
+        _BLOB_NAMES.setdefault(digest, set()).add(name)
+
+def _track_blob_entries(records, before, after):
+    with _BLOB_INDEX_LOCK:
+        for sets, dels in records:
+            for path, value in sets:
+                if len(path) == 1:
+                    _index_blob_entry(path[0], value)
+            for path in dels:
+                if len(path) == 1:
+                    _index_blob_entry(path[0], None)
+
+_metadata_store.add_listener(_track_blob_entries)
+
+def _blob_names(digest):
+    global _BLOB_INDEX_READY
+    with _BLOB_INDEX_LOCK:
+        if not _BLOB_INDEX_READY:
+            for name, entry in read_metadata().items():
+                _index_blob_entry(name, entry)
+            _BLOB_INDEX_READY = True
+        return list(_BLOB_NAMES.get(digest, ()))
+
+def _blob_offerable(digest):
+    # The blob may only stand in for a file the caller could already read: some name linked to it must be
+    # unprotected and outside hidden groups, the same rule _find_identical_file applies
+    if not blob_store.has(digest):
+        return False
+    groups = _metadata_store.peek('__groups__') or {}
+    for name in _blob_names(digest):
+        entry = _metadata_store.peek(name)
+        if not is_file_entry(name, entry) or entry.get('blob') != digest or entry.get('password_hash'):
+            continue
+        grp = groups.get(entry.get('group_id') or 'root')
+        if not (isinstance(grp, dict) and grp.get('hidden')):
+            return True
+    return False
+
+@app.route('/api/files/check', methods=['POST'])
+def check_existing_file():
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data.get('size'))
+        chunk_size = int(data.get('chunk_size') or 1024 * 1024)
+    except Exception:
+        return jsonify({'error': 'size required'}), 400
+    digest = (data.get('sha256') or '').strip().lower() or None
+    head = (data.get('head_sha256') or '').strip().lower() or None
+    tail = (data.get('tail_sha256') or '').strip().lower() or None
+    if not digest and not (head and tail):
+        return jsonify({'error': 'sha256 or head_sha256/tail_sha256 required'}), 400
+    uploader = data.get('uploader') or ''
+    password = data.get('password') or ''
+    group_id = (data.get('group_id') or 'root').strip() or 'root'
+    meta = load_metadata()
+    src_path, src_entry = None, {}
+    if digest and _blob_offerable(digest) and os.path.getsize(blob_store.blob_path(digest)) == size:
+        src_path, src_entry = blob_store.blob_path(digest), {'blob': digest}
+    else:
+        src_path, src_entry = _find_identical_file(meta, size, digest, head, tail, chunk_size)
+    if not src_path:
+        return jsonify({'matched': False})
+    incoming = _incoming_dir()
+    os.makedirs(incoming, exist_ok=True)
+    tmp_path = os.path.join(incoming, secrets.token_hex(16) + '.part')
+    try:
+        os.link(src_path, tmp_path)
+        linked = True
+    except OSError:
+        # No hard links on this volume: a local copy still keeps the bytes off the network
+        shutil.copyfile(src_path, tmp_path)
+        linked = False
+
+    def _adjust(entry):
+        if linked:
+            if src_entry.get('blob'):
+                entry['blob'] = src_entry['blob']
+            if not _config.get('use_source_date'):
+                entry['mtime'] = time.time()
+    try:
+        [(filename, save_path)] = _publish_uploads(meta, [(_clean_upload_name(data.get('filename') or ''), tmp_path, digest or src_entry.get('blob'))], uploader, group_id, password=password, adjust=_adjust)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    log(f'[秒传] 命中已有内容: {filename} <- {os.path.basename(src_path)}')
+    track_event('file_upload', {'status': 'success', 'file_count': 1, 'total_bytes': 0, 'instant': True})
+    return _upload_created([filename], _schedule_post_upload([(filename, save_path)]), matched=True)
+
+_LIST_DEFAULT_PAGE = 100
+_LIST_MAX_PAGE = 1000
+
+# Sort keys for file listings; the name tiebreak makes every key unique, which keyset cursors rely on
+_LIST_SORT_KEYS = {
+    'mtime': lambda c: (c[2].get('mtime') or c[1].st_mtime, c[0]),
+    'name': lambda c: (c[0].lower(), c[0]),
+    'size': lambda c: (c[1].st_size, c[0]),
+    'uploader': lambda c: ((c[2].get('uploader') or '').lower(), c[0]),
+}
+
+def _list_candidates(meta, group_filter, matches=None):
+    # (name, stat, entry) for every file the listing may show, with all filters applied before items are built
+    if not os.path.exists(app.config['UPLOAD_FOLDER']):
+        return []
+    # Files without metadata count as root, so only other groups can be narrowed down by the index
+    if group_filter and group_filter != 'root':
+        listing = [(f, file_index.get(f)) for f in _metadata_store.names_in_group(group_filter)]
+    else:
+        listing = file_index.items()
+    hidden_ids = set()
+    if not _is_local_request():
+        hidden_ids = {gid for gid, g in meta.get('__groups__', {}).items() if g.get('hidden')}
+    metadata_name = os.path.basename(METADATA_FILE).lower()
+    out = []
+    for f, st in listing:
+        if st is None or f.lower() == metadata_name:
+            continue
+        entry = meta.get(f, {})
+        gid = entry.get('group_id') or 'root'
+        if group_filter and gid != group_filter:
+            continue
+        if gid in hidden_ids:
+            continue
+        if matches is not None and f not in matches:
+            continue
+        out.append((f, st, entry))
+    return out
+
+_LIST_CACHE = {}
+_LIST_CACHE_MAX = 8
+_LIST_CACHE_LOCK = threading.Lock()
+
+def _sorted_candidates(meta, group_filter, q, sort):
+    # Ascending (keys, candidates) for one query, reused until the folder index or the metadata changes
+    cache_key = (file_index.version, _metadata_store.version, app.config['UPLOAD_FOLDER'],
+                 group_filter, q, sort, _is_local_request())
+    with _LIST_CACHE_LOCK:
+        hit = _LIST_CACHE.get(cache_key)
+    if hit is not None:
+        return hit
+    # Search goes through the trigram index; only its matches reach the filters below
+    matches = search_index.search(q) if q else None
+    if sort == 'relevance':
+        scores = matches or {}
+        sort_key = lambda c: (-scores.get(c[0], 0.0), c[0])
+    else:
+        sort_key = _LIST_SORT_KEYS[sort]
+    decorated = sorted((sort_key(c), c) for c in _list_candidates(meta, group_filter, matches))
+    result = ([k for k, _ in decorated], [c for _, c in decorated])
+    with _LIST_CACHE_LOCK:
+        if len(_LIST_CACHE) >= _LIST_CACHE_MAX:
+            _LIST_CACHE.pop(next(iter(_LIST_CACHE)))
+        _LIST_CACHE[cache_key] = result
+    return result
+
+def _file_item(f, st, entry):
+    item = {
+        'name': f,
+        'size': st.st_size,
+        'mtime': entry.get('mtime') or st.st_mtime,
+        'uploader': entry.get('uploader', ''),
+        'has_password': bool(entry.get('password_hash')),
+        'group_id': entry.get('group_id', 'root')
+    }
+    digest = None if entry.get('password_hash') else _entry_digest(entry, st)
+    if digest:
+        item['sha256'] = digest
+    return item
+
+def _encode_list_cursor(key, sort, order):
+    raw = json.dumps({'s': sort, 'o': order, 'k': list(key)}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_list_cursor(cursor, sort, order):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw.decode('utf-8'))
+        if data.get('s') != sort or data.get('o') != order:
+            return None
+        key = data.get('k')
+        if not isinstance(key, list) or len(key) != 2:
+            return None
+        return tuple(key)
+    except Exception:
+        return None
+
 @app.route('/api/files', methods=['GET', 'POST'])
 def handle_files():
     if request.method == 'POST':
+        if _config.get('streaming_upload', True) and request.mimetype == 'multipart/form-data':
+            return _streaming_multipart_upload()
         files = request.files.getlist('file')
         if not files:
             return jsonify({'error': 'No file part'}), 400
-        saved = []
+        received = []
         uploader = request.form.get('uploader', '')
         password = request.form.get('password', '')
         group_id = (request.form.get('group_id') or 'root').strip() or 'root'
-        meta = load_metadata()
         total_bytes = 0
         try:
             current_upload_folder = app.config['UPLOAD_FOLDER']
@@ -1393,100 +2428,365 @@ def handle_files():
             for file in files:
                 if not file or file.filename == '':
                     continue
-                raw_name = file.filename or ''
-                base_name = os.path.basename(raw_name)
-                base_name = ''.join(ch for ch in base_name if ch not in '\\/:*?"<>|')
-                filename = base_name.strip()
-                if not filename or filename in ('.','..'):
-                    b, e = os.path.splitext(base_name)
-                    ts = str(int(time.time()*1000))
-                    safe_base = (b or 'file_' + ts).strip() or ('file_' + ts)
-                    safe_ext = e.replace('.', '')
-                    filename = safe_base + (('.' + safe_ext) if safe_ext else '')
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                if os.path.exists(save_path):
-                    b, e = os.path.splitext(filename)
-                    ts = str(int(time.time() * 1000))
-                    candidate = f"{b}_{ts}{e}"
-                    save_path = os.path.join(app.config['UPLOAD_FOLDER'], candidate)
-                    while os.path.exists(save_path):
-                        ts = str(int(time.time() * 1000))
-                        candidate = f"{b}_{ts}{e}"
-                        save_path = os.path.join(app.config['UPLOAD_FOLDER'], candidate)
-                    filename = candidate
-                file.save(save_path)
+                filename, writer = _open_upload_writer(_clean_upload_name(file.filename), expected_size=_stream_size(file.stream))
                 try:
-                    total_bytes += int(os.path.getsize(save_path))
+                    writer.copy_from(file.stream)
+                    writer.close()
                 except Exception:
-                    pass
-                if _config.get('use_source_date'):
-                    apply_exif_date(save_path)
-                log(f'[上传] 文件: {filename}, 保存路径: {save_path}, 账号: "{uploader}", 密码: {"已设置" if password else "未设置"}')
-                entry = {'uploader': uploader, 'password_hash': None, 'group_id': group_id}
-                if password:
-                    entry['password_hash'] = _generate_password_hash(password)
-                meta[filename] = entry
-                saved.append(filename)
-            if saved:
-                save_metadata(meta)
-                log(f'[上传] Metadata 已保存: {len(saved)} 个条目')
-                track_event('file_upload', {'status': 'success', 'file_count': len(saved), 'total_bytes': total_bytes})
-                return jsonify({'message': 'ok', 'saved': saved}), 201
+                    writer.abort()
+                    raise
+                total_bytes += writer.size
+                received.append((filename, writer))
+            if received:
+                return _upload_created(*_register_streamed_uploads(received, uploader, password, group_id))
             return jsonify({'error': 'No selected file'}), 400
         except Exception as e:
-            track_event('file_upload', {'status': 'fail', 'file_count': len(saved), 'total_bytes': total_bytes, 'error': str(e)[:200]})
+            track_event('file_upload', {'status': 'fail', 'file_count': len(received), 'total_bytes': total_bytes, 'error': str(e)[:200]})
             return jsonify({'error': 'upload failed'}), 500
     
-    files = []
-    meta = load_metadata()
+    not_modified = _listing_not_modified('files', file_index.version)
+    if not_modified is not None:
+        return not_modified
+    meta = read_metadata()
+    paginate = 'limit' in request.args or 'cursor' in request.args
+    sort = (request.args.get('sort') or 'mtime').strip()
+    order = (request.args.get('order') or ('desc' if sort == 'mtime' else 'asc')).strip()
+    if (sort not in _LIST_SORT_KEYS and sort != 'relevance') or order not in ('asc', 'desc'):
+        return jsonify({'error': 'invalid sort'}), 400
 
     if _config.get('mode') == 'oneway' and not _is_local_request():
-        return jsonify([])
+        return jsonify({'items': [], 'next_cursor': None, 'total': 0} if paginate else [])
 
-    upload_folder = app.config['UPLOAD_FOLDER']
     q = (request.args.get('q') or '').strip().lower()
     group_filter = (request.args.get('group_id') or '').strip()
-    if os.path.exists(upload_folder):
-        for f in os.listdir(upload_folder):
-            file_path = os.path.join(upload_folder, f)
-            if f.lower() == os.path.basename(METADATA_FILE).lower():
-                continue
-            if os.path.isfile(file_path):
-                size = os.path.getsize(file_path)
-                mtime = os.path.getmtime(file_path)
-                entry = meta.get(f, {})
-                files.append({
-                    'name': f,
-                    'size': size,
-                    'mtime': mtime,
-                    'uploader': entry.get('uploader', ''),
-                    'has_password': bool(entry.get('password_hash')),
-                    'group_id': entry.get('group_id', 'root')
-                })
-    files.sort(key=lambda x: x['mtime'], reverse=True)
-    # Filter by group if provided
-    if group_filter:
-        files = [it for it in files if (it.get('group_id') or 'root') == group_filter]
-    # Fuzzy search if q provided
-    if q:
-        def _score(name: str, q: str) -> float:
+    keys, ordered = _sorted_candidates(meta, group_filter, q, sort)
+    if not paginate:
+        if order == 'desc':
+            ordered = ordered[::-1]
+        return jsonify([_file_item(f, st, entry) for f, st, entry in ordered])
+
+    try:
+        limit = max(1, min(_LIST_MAX_PAGE, int(request.args.get('limit') or _LIST_DEFAULT_PAGE)))
+    except ValueError:
+        return jsonify({'error': 'invalid limit'}), 400
+    cursor = request.args.get('cursor')
+    after = None
+    if cursor:
+        after = _decode_list_cursor(cursor, sort, order)
+        if after is None:
+            return jsonify({'error': 'invalid cursor'}), 400
+    # Keyset page: the cursor holds the last key served, so pages stay stable while files come and go
+    if order == 'asc':
+        start = bisect.bisect_right(keys, after) if after is not None else 0
+        page = ordered[start:start + limit]
+        last = start + len(page) - 1
+        more = start + limit < len(ordered)
+    else:
+        end = bisect.bisect_left(keys, after) if after is not None else len(ordered)
+        page = ordered[max(0, end - limit):end][::-1]
+        last = max(0, end - limit)
+        more = end - limit > 0
+    next_cursor = _encode_list_cursor(keys[last], sort, order) if more and page else None
+    return jsonify({
+        'items': [_file_item(f, st, entry) for f, st, entry in page],
+        'next_cursor': next_cursor,
+        'total': len(ordered),
+    })
+
+# --- Resumable upload sessions ---
+upload_sessions = UploadSessionStore(lambda: os.path.join(app.config['UPLOAD_FOLDER'], INTERNAL_DIR_NAME))
+upload_sessions.set_logger(log)
+
+# --- Disk space admission control ---
+disk_guard = DiskSpaceGuard(
+    lambda: app.config['UPLOAD_FOLDER'],
+    pending_getter=upload_sessions.pending_bytes,
+    margin_getter=lambda: int(_config.get('disk_reserve_mb', 256)) * 1024 * 1024,
+)
+_ADMISSION_ENDPOINTS = ('handle_files', 'put_file_raw')
+
+def _insufficient_storage(required, available):
+    log(f'[上传] 空间不足, 拒绝: 需要 {required} 字节, 可用 {available} 字节')
+    return jsonify({'error': 'insufficient storage', 'message': '磁盘空间不足', 'required': required, 'available': available}), 507
+
+@app.before_request
+def _upload_admission():
+    # Decide from Content-Length before any of the body is read, instead of failing mid-write
+    if request.method not in ('POST', 'PUT') or request.endpoint not in _ADMISSION_ENDPOINTS:
+        return None
+    # For compressed bodies only the encoded length is known up front, a lower bound of what gets written
+    nbytes = request.content_length or int(request.environ.get('quicksend.encoded_length') or 0)
+    if not nbytes:
+        return None
+    token, available = disk_guard.try_reserve(nbytes)
+    if token is None:
+        return _insufficient_storage(nbytes, available)
+    g.disk_reservation = token
+    return None
+
+@app.teardown_request
+def _release_upload_reservation(exc):
+    disk_guard.release(g.pop('disk_reservation', None))
+
+@app.route('/api/disk')
+def api_disk():
+    return jsonify(disk_guard.status())
+
+# --- Bandwidth shaping / fair sharing between clients ---
+def _transfer_settings():
+    return {
+        'global_rate': int(_config.get('bandwidth_global_kbs') or 0) * 1024,
+        'client_rate': int(_config.get('bandwidth_client_kbs') or 0) * 1024,
+        'max_per_client': int(_config.get('max_transfers_per_client') or 0),
+        'weights': _config.get('client_weights') or {},
+    }
+
+transfer_scheduler = TransferScheduler(_transfer_settings)
+transfer_scheduler.set_logger(log)
+_SHAPED_UPLOADS = ('handle_files', 'put_file_raw', 'put_upload_chunk')
+_SHAPED_DOWNLOADS = ('download_file', 'download_archive', 'download_zip_member', 'serve_office_temp')
+
+@app.before_request
+def _open_transfer():
+    if not transfer_scheduler.enabled():
+        return None
+    if request.endpoint in _SHAPED_UPLOADS and request.method in ('POST', 'PUT', 'PATCH'):
+        kind = 'upload'
+    elif request.endpoint in _SHAPED_DOWNLOADS:
+        kind = 'download'
+    else:
+        return None
+    client = request.remote_addr or ''
+    transfer = transfer_scheduler.open(client, kind, (request.view_args or {}).get('filename') or '')
+    if transfer is None:
+        resp = jsonify({'error': 'too many transfers', 'message': '同时传输数量已达上限'})
+        resp.headers['Retry-After'] = '5'
+        return resp, 429
+    g.transfer = transfer
+    if kind == 'upload':
+        raw = request.environ.get('quicksend.raw_input')
+        if raw is not None:
+            # Compressed body: pace the encoded bytes coming off the socket, below the decoder
+            raw.stream = transfer_scheduler.wrap_reader(transfer, raw.stream)
+        else:
+            # request.stream is not built yet, so it will read through the throttle
+            request.environ['wsgi.input'] = transfer_scheduler.wrap_reader(transfer, request.environ['wsgi.input'])
+    return None
+
+@app.after_request
+def _shape_download(resp):
+    transfer = g.get('transfer')
+    if transfer is None or transfer['kind'] != 'download' or resp.status_code >= 300:
+        return resp
+    # The body outlives the request context: hand the transfer to the body, which closes it when done.
+    # This replaces wsgi.file_wrapper, so shaped downloads give up sendfile.
+    resp.response = transfer_scheduler.wrap_iter(transfer, resp.response)
+    g.pop('transfer', None)
+    return resp
+
+@app.teardown_request
+def _close_transfer(exc):
+    transfer_scheduler.close(g.pop('transfer', None))
+
+@app.route('/api/transfers')
+def api_transfers():
+    if not _is_local_request():
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(transfer_scheduler.stats())
+
+# --- Compressed upload bodies ---
+_DECODED_ENDPOINTS = ('handle_files', 'put_file_raw', 'put_upload_chunk')
+
+def _decompressed_limit():
+    try:
+        mb = int(_config.get('max_decompressed_mb') or 0)
+    except Exception:
+        mb = 0
+    return mb * 1024 * 1024 if mb > 0 else app.config['MAX_CONTENT_LENGTH']
+
+def _session_size_limit():
+    # MAX_CONTENT_LENGTH bounds one request body; a session file is assembled from many, so only this (0 = none)
+    # and disk admission bound it
+    try:
+        mb = int(_config.get('max_session_mb') or 0)
+    except Exception:
+        mb = 0
+    return mb * 1024 * 1024 if mb > 0 else None
+
+def _unsupported_encoding(environ, start_response):
+    resp = jsonify({'error': 'unsupported content encoding', 'supported': supported_encodings()})
+    resp.status_code = 415
+    resp.headers['Accept-Encoding'] = ', '.join(supported_encodings())
+    return resp(environ, start_response)
+
+class _RawUploadBody:
+    # The encoded body under a DecodingReader; _open_transfer swaps in a throttled stream once the request is routed
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+class _DecompressUploadBody:
+    """Replaces a Content-Encoded upload body with a reader that inflates it as it is consumed.
+
+    Runs below Flask so every upload path (multipart parsing, raw PUT,
+    session chunks) just sees the decoded bytes on request.stream.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        encoding = (environ.get('HTTP_CONTENT_ENCODING') or '').strip().lower()
+        if encoding and encoding != 'identity' and environ.get('REQUEST_METHOD') in ('POST', 'PUT', 'PATCH'):
             try:
-                if q in name:
-                    return 1.0
-                return difflib.SequenceMatcher(None, name, q).ratio()
+                endpoint, _ = app.url_map.bind_to_environ(environ).match()
             except Exception:
-                return 0.0
-        files = [it for it in files if _score((it.get('name','').lower()), q) >= 0.5]
-    if not _is_local_request():
-        groups = meta.get('__groups__', {})
-        hidden_ids = {gid for gid, g in groups.items() if g.get('hidden')}
-        if hidden_ids:
-            files = [it for it in files if (it.get('group_id') or 'root') not in hidden_ids]
-    return jsonify(files)
+                endpoint = None
+            if endpoint in _DECODED_ENDPOINTS:
+                if encoding not in supported_encodings():
+                    with app.app_context():
+                        return _unsupported_encoding(environ, start_response)
+                try:
+                    raw = get_input_stream(environ, max_content_length=app.config['MAX_CONTENT_LENGTH'])
+                except HTTPException as e:
+                    return e(environ, start_response)
+                raw = environ['quicksend.raw_input'] = _RawUploadBody(raw)
+                environ['wsgi.input'] = DecodingReader(raw, encoding, limit=_decompressed_limit())
+                environ['wsgi.input_terminated'] = True
+                environ['quicksend.encoded_length'] = environ.pop('CONTENT_LENGTH', None)
+                del environ['HTTP_CONTENT_ENCODING']
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = _DecompressUploadBody(app.wsgi_app)
+
+def _session_json(state):
+    return {
+        'id': state['id'],
+        'filename': state['filename'],
+        'size': state['size'],
+        'offset': state['offset'],
+        'parallel': bool(state.get('parallel')),
+        'missing': upload_sessions.missing_ranges(state),
+        'chunk_size': UploadSessionStore.CHUNK_READ_SIZE * 8,
+    }
+
+def _session_error(e):
+    body = {'error': e.message}
+    body.update(e.extra)
+    resp = jsonify(body)
+    if 'offset' in e.extra:
+        resp.headers['Upload-Offset'] = str(e.extra['offset'])
+    return resp, e.status
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload_session():
+    data = (request.get_json(silent=True) or (request.form.to_dict() if request.form else {}) or {})
+    try:
+        size = int(data.get('size'))
+    except Exception:
+        return jsonify({'error': 'size required'}), 400
+    if size < 0:
+        return jsonify({'error': 'invalid size'}), 400
+    limit = _session_size_limit()
+    if limit is not None and size > limit:
+        return jsonify({'error': 'file too large', 'limit': limit}), 413
+    filename = _clean_upload_name(data.get('filename') or '')
+    password = data.get('password') or ''
+    group_id = (data.get('group_id') or 'root').strip() or 'root'
+    # Hold the space while the session is created
+    token, available = disk_guard.try_reserve(size)
+    if token is None:
+        return _insufficient_storage(size, available)
+    g.disk_reservation = token
+    state = upload_sessions.create(
+        filename,
+        size,
+        uploader=(data.get('uploader') or ''),
+        password_hash=(_generate_password_hash(password) if password else None),
+        group_id=group_id,
+        parallel=str(data.get('parallel') or '').lower() in ('1', 'true', 'yes'),
+    )
+    # The session now holds the space itself, preallocated or as pending bytes
+    disk_guard.release(g.pop('disk_reservation', None))
+    resp = jsonify(_session_json(state))
+    resp.headers['Upload-Offset'] = '0'
+    resp.headers['Location'] = f"/api/uploads/{state['id']}"
+    return resp, 201
+
+@app.route('/api/uploads/<sid>', methods=['GET', 'HEAD'])
+def get_upload_session(sid):
+    state = upload_sessions.get(sid)
+    if not state:
+        return jsonify({'error': 'not found'}), 404
+    resp = jsonify(_session_json(state))
+    resp.headers['Upload-Offset'] = str(state['offset'])
+    resp.headers['Upload-Length'] = str(state['size'])
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+@app.route('/api/uploads/<sid>', methods=['PUT', 'PATCH'])
+def put_upload_chunk(sid):
+    # Parallel sessions take "Content-Range: bytes a-b/total" so several connections can fill disjoint ranges
+    end = None
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is not None and content_range.start is not None:
+        offset, end = content_range.start, content_range.stop
+    else:
+        raw_offset = request.headers.get('Upload-Offset') or request.args.get('offset')
+        try:
+            offset = int(raw_offset)
+        except Exception:
+            return jsonify({'error': 'offset required'}), 400
+    try:
+        state = upload_sessions.write_chunk(sid, offset, request.stream, end=end)
+    except UploadSessionError as e:
+        return _session_error(e)
+    resp = jsonify(_session_json(state))
+    resp.headers['Upload-Offset'] = str(state['offset'])
+    return resp
+
+@app.route('/api/uploads/<sid>/finalize', methods=['POST'])
+def finalize_upload_session(sid):
+    def _commit(state, part):
+        meta = load_metadata()
+        [(filename, save_path)] = _publish_uploads(meta, [(state['filename'], part, state.get('sha256'))], state.get('uploader') or '', state.get('group_id') or 'root', password_hash=state.get('password_hash'))
+        return filename, save_path, state['size']
+    try:
+        filename, save_path, size = upload_sessions.finalize(sid, _commit)
+    except UploadSessionError as e:
+        return _session_error(e)
+    except Exception as e:
+        log(f'[分片上传] 完成失败: {sid}: {e}')
+        track_event('file_upload', {'status': 'fail', 'file_count': 0, 'resumable': True, 'error': str(e)[:200]})
+        return jsonify({'error': 'upload failed'}), 500
+    track_event('file_upload', {'status': 'success', 'file_count': 1, 'total_bytes': size, 'resumable': True})
+    return _upload_created([filename], _schedule_post_upload([(filename, save_path)]))
+
+@app.route('/api/uploads/<sid>', methods=['DELETE'])
+def delete_upload_session(sid):
+    if not upload_sessions.discard(sid):
+        return jsonify({'error': 'not found'}), 404
+    return jsonify({'message': 'deleted'})
+
+@app.route('/api/jobs')
+def list_jobs():
+    return jsonify(post_jobs.stats())
+
+@app.route('/api/jobs/<jid>')
+def get_job(jid):
+    job = post_jobs.get(jid)
+    if not job:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(job)
 
 @app.route('/api/texts', methods=['GET','POST'])
 def handle_texts():
+    if request.method == 'GET':
+        not_modified = _listing_not_modified('texts')
+        if not_modified is not None:
+            return not_modified
     meta = load_metadata()
     if request.method == 'POST':
         try:
@@ -1550,11 +2850,8 @@ def text_item_api(tid):
     if not entry:
         return jsonify({'error': 'not found'}), 404
     if request.method == 'GET':
-        password_hash = entry.get('password_hash')
-        if password_hash:
-            pwd = request.args.get('password','')
-            if not pwd or not _check_password_hash(password_hash, pwd):
-                return jsonify({'error':'password required'}), 403
+        if not _can_access('text', tid, entry.get('password_hash'), request.args.get('password', '')):
+            return jsonify({'error':'password required'}), 403
         return jsonify({'content': entry.get('content','')})
     uploader_id = None
     uploader_name = None
@@ -1629,6 +2926,10 @@ def set_text_password(tid):
 # --- Groups API ---
 @app.route('/api/groups', methods=['GET','POST'])
 def api_groups():
+    if request.method == 'GET':
+        not_modified = _listing_not_modified('groups')
+        if not_modified is not None:
+            return not_modified
     meta = load_metadata()
     groups = meta.get('__groups__', {})
     if request.method == 'POST':
@@ -1727,28 +3028,33 @@ def api_group_delete(gid):
         return jsonify({'error':'not found'}), 404
     parent_id = groups[gid].get('parent_id') or 'root'
     # reparent child groups to parent
-    for _id, g in list(groups.items()):
-        if g.get('parent_id') == gid:
+    for _id in _metadata_store.child_groups(gid):
+        g = groups.get(_id)
+        if g and g.get('parent_id') == gid:
             g['parent_id'] = parent_id
             g['mtime'] = time.time()
             groups[_id] = g
-    # handle direct files of this group
+    # handle direct files of this group (looked up through the store rather than scanning every entry)
+    members = _metadata_store.names_in_group(gid)
     if mode == 'delete_with_files':
-        upload_folder = app.config['UPLOAD_FOLDER']
-        for fname, entry in list(meta.items()):
-            if fname in ('__groups__','__texts__','__debug__'):
+        for fname in members:
+            entry = meta.get(fname)
+            if fname in SECTION_KEYS:
                 continue
             if isinstance(entry, dict) and entry.get('group_id') == gid:
                 try:
-                    p = os.path.join(upload_folder, fname)
-                    if os.path.exists(p) and os.path.isfile(p):
+                    p = _upload_path(fname)
+                    if p and os.path.isfile(p):
                         os.remove(p)
+                        file_index.refresh(fname)
+                    blob_store.release(entry.get('blob'))
                 except Exception:
                     pass
                 meta.pop(fname, None)
     else:
-        for fname, entry in list(meta.items()):
-            if fname in ('__groups__','__texts__','__debug__'):
+        for fname in members:
+            entry = meta.get(fname)
+            if fname in SECTION_KEYS:
                 continue
             if isinstance(entry, dict) and entry.get('group_id') == gid:
                 entry['group_id'] = parent_id
@@ -1762,13 +3068,13 @@ def api_group_delete(gid):
 def api_set_file_group(filename):
     meta = load_metadata()
     entry = meta.get(filename)
-    if filename.lower() == os.path.basename(METADATA_FILE).lower():
+    if _is_protected_name(filename):
         return jsonify({'error': 'protected'}), 403
 
     if not entry:
         # Check if file exists on disk (in case it wasn't in metadata yet)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(file_path) and os.path.isfile(file_path):
+        file_path = _upload_path(filename)
+        if file_path and os.path.isfile(file_path):
             # Create default entry
             entry = {'uploader': '', 'password_hash': None, 'group_id': 'root'}
         else:
@@ -1806,7 +3112,7 @@ def api_group_hidden(gid):
 
 @app.route('/api/files/<path:filename>', methods=['DELETE'])
 def delete_file_api(filename):
-    if filename.lower() == os.path.basename(METADATA_FILE).lower():
+    if _is_protected_name(filename):
         return jsonify({'error': 'protected'}), 403
     uploader = None
     if request.is_json:
@@ -1820,9 +3126,13 @@ def delete_file_api(filename):
     if owner and uploader != owner and not _is_local_request():
         return jsonify({'error': 'not owner'}), 403
     try:
-        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        path = _upload_path(filename)
+        if path:
+            os.remove(path)
     except FileNotFoundError:
         pass
+    file_index.refresh(filename)
+    blob_store.release(entry.get('blob'))
     if filename in meta:
         meta.pop(filename)
         save_metadata(meta)
@@ -1830,20 +3140,144 @@ def delete_file_api(filename):
 
 @app.route('/download/<path:filename>')
 def download_file(filename):
-    if filename.lower() == os.path.basename(METADATA_FILE).lower():
+    if _is_protected_name(filename):
         return jsonify({'error': 'protected'}), 403
-    meta = load_metadata()
+    meta = read_metadata()
     entry = meta.get(filename, {})
     password_hash = entry.get('password_hash')
     log(f'[下载] 文件: {filename}, 有密码: {bool(password_hash)}')
     if password_hash:
         pwd = request.args.get('password', '')
         log(f'[下载] 收到密码: {bool(pwd)}')
-        if not pwd or not _check_password_hash(password_hash, pwd):
+        if not _can_access('file', filename, password_hash, pwd):
             return jsonify({'error': 'password required'}), 403
     
     is_preview = request.args.get('preview', '').lower() == 'true'
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=not is_preview)
+    digest = None
+    try:
+        digest = _entry_digest(entry, os.stat(_upload_path(filename) or ''))
+    except OSError:
+        pass
+    if not digest:
+        return _send_upload(filename, as_attachment=not is_preview)
+    # Content hash as a strong validator: If-None-Match / If-Range work across renames and re-uploads
+    resp = _send_upload(filename, as_attachment=not is_preview, etag=digest)
+    return _digest_headers(resp, digest)
+
+# --- Multi-file / group ZIP download ---
+def _arc_component(name, fallback):
+    name = (name or '').replace('/', '_').replace('\\', '_').strip().strip('.')
+    return name or fallback
+
+def _archive_group_dirs(groups, root_gid, hidden_ids, recursive):
+    # gid -> folder prefix inside the archive; the requested group's own files sit at the top
+    dirs = {root_gid: ''}
+    if not recursive:
+        return dirs
+    children = {}
+    for gid, grp in groups.items():
+        pid = grp.get('parent_id') or 'root'
+        if pid != 'root' and pid not in groups:
+            pid = 'root'
+        children.setdefault(pid, []).append(gid)
+    stack = [root_gid]
+    while stack:
+        parent = stack.pop()
+        used = set()
+        for gid in sorted(children.get(parent, []), key=lambda x: groups[x].get('name') or ''):
+            if gid in dirs or gid in hidden_ids:
+                continue
+            base = _arc_component(groups[gid].get('name'), gid[:8])
+            comp, n = base, 2
+            while comp.lower() in used:
+                comp, n = f'{base} ({n})', n + 1
+            used.add(comp.lower())
+            dirs[gid] = dirs[parent] + comp + '/'
+            stack.append(gid)
+    return dirs
+
+@app.route('/api/archive', methods=['GET', 'POST'])
+def download_archive():
+    # Stream several files, or a whole group tree, as one ZIP instead of one request per file
+    data = request.get_json(silent=True) or {}
+    names = data.get('files') or request.values.getlist('files') or request.values.getlist('file')
+    if isinstance(names, str):
+        names = [names]
+    group_id = (data.get('group_id') or request.values.get('group_id') or '').strip()
+    recursive = str(data.get('recursive', request.values.get('recursive', ''))).lower() in ('1', 'true', 'yes')
+    password = data.get('password') or request.values.get('password') or ''
+    passwords = data.get('passwords') if isinstance(data.get('passwords'), dict) else {}
+    tokens = data.get('tokens') if isinstance(data.get('tokens'), dict) else {}
+
+    meta = read_metadata()
+    groups = meta.get('__groups__', {})
+    local = _is_local_request()
+    hidden_ids = set() if local else {gid for gid, grp in groups.items() if grp.get('hidden')}
+    upload_folder = app.config['UPLOAD_FOLDER']
+
+    def _unlocked(name, entry):
+        return _can_access('file', name, entry.get('password_hash'), passwords.get(name) or password, token=tokens.get(name))
+
+    members = []
+    skipped = 0
+    archive_name = 'QuickSend'
+    if names:
+        missing, locked, seen = [], [], set()
+        for name in names:
+            name = str(name)
+            path = None if _is_protected_name(name) else _upload_path(name)
+            entry = meta.get(name, {})
+            if not path or not os.path.isfile(path) or (entry.get('group_id') or 'root') in hidden_ids:
+                missing.append(name)
+                continue
+            if not _unlocked(name, entry):
+                locked.append(name)
+                continue
+            if name not in seen:
+                seen.add(name)
+                members.append((name, path))
+        if missing:
+            return jsonify({'error': 'not found', 'files': missing}), 404
+        if locked:
+            return jsonify({'error': 'password required', 'files': locked}), 403
+    elif group_id:
+        if _config.get('mode') == 'oneway' and not local:
+            return jsonify({'error': 'forbidden'}), 403
+        if group_id != 'root' and (group_id not in groups or group_id in hidden_ids):
+            return jsonify({'error': 'not found'}), 404
+        if group_id != 'root':
+            archive_name = _arc_component(groups[group_id].get('name'), archive_name)
+        dirs = _archive_group_dirs(groups, group_id, hidden_ids, recursive)
+        if os.path.exists(upload_folder):
+            for f in sorted(name for name, _ in file_index.items()):
+                if _is_protected_name(f):
+                    continue
+                entry = meta.get(f, {})
+                prefix = dirs.get(entry.get('group_id') or 'root')
+                if prefix is None:
+                    continue
+                path = _upload_path(f)
+                if not path or not os.path.isfile(path):
+                    continue
+                if not _unlocked(f, entry):
+                    # Locked files are left out of group archives rather than failing the whole download
+                    skipped += 1
+                    continue
+                members.append((prefix + f, path))
+    else:
+        return jsonify({'error': 'files or group_id required'}), 400
+    if not members:
+        return jsonify({'error': 'no files', 'skipped': skipped}), 404
+
+    log(f'[下载] 打包下载: {len(members)} 个文件, 跳过加密文件: {skipped}')
+    resp = Response(stream_with_context(iter_zip(members)), mimetype='application/zip')
+    zip_name = f'{archive_name}.zip'
+    ascii_name = zip_name.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'QuickSend.zip'
+    resp.headers['Content-Disposition'] = f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(zip_name)}"
+    resp.headers['Cache-Control'] = 'no-store'
+    resp.headers['X-Archive-Files'] = str(len(members))
+    resp.headers['X-Archive-Skipped'] = str(skipped)
+    return resp
 
 # --- Office Preview Support (conversion and cache) ---
 CACHE_ROOT = os.path.join(_DATA_ROOT, 'QuickSend', 'cache')
@@ -1891,32 +3325,107 @@ def _office_signing_key():
     except Exception:
         return hashlib.sha256(b'quicksend|office-preview|v1').digest()
 
-def _make_office_token(rel_path, expires_at):
-    payload = json.dumps({'p': rel_path, 'e': int(expires_at)}, separators=(',', ':')).encode('utf-8')
-    sig = hmac.new(_office_signing_key(), payload, hashlib.sha256).digest()
+def _sign_token(key, obj):
+    payload = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    sig = hmac.new(key, payload, hashlib.sha256).digest()
     return f"{_b64url_encode(payload)}.{_b64url_encode(sig)}"
 
-def _verify_office_token(token):
+def _verify_signed_token(key, token):
+    # Returns the payload of an authentic, unexpired token ('e' is the expiry), else None
     try:
         parts = (token or '').split('.', 1)
         if len(parts) != 2:
             return None
         payload_b = _b64url_decode(parts[0])
         sig_b = _b64url_decode(parts[1])
-        expected = hmac.new(_office_signing_key(), payload_b, hashlib.sha256).digest()
+        expected = hmac.new(key, payload_b, hashlib.sha256).digest()
         if not hmac.compare_digest(sig_b, expected):
             return None
         obj = json.loads(payload_b.decode('utf-8'))
-        exp = int(obj.get('e') or 0)
-        if exp <= int(time.time()):
+        if int(obj.get('e') or 0) <= int(time.time()):
             return None
-        rel = (obj.get('p') or '').replace('\\', '/')
-        if not rel or rel.startswith('../') or rel.startswith('..\\'):
-            return None
-        return {'rel': rel, 'exp': exp}
+        return obj
     except Exception:
         return None
 
+def _make_office_token(rel_path, expires_at):
+    return _sign_token(_office_signing_key(), {'p': rel_path, 'e': int(expires_at)})
+
+def _verify_office_token(token):
+    obj = _verify_signed_token(_office_signing_key(), token)
+    if not obj:
+        return None
+    rel = (obj.get('p') or '').replace('\\', '/')
+    if not rel or rel.startswith('../') or rel.startswith('..\\'):
+        return None
+    return {'rel': rel, 'exp': int(obj['e'])}
+
+# --- Unlock tokens: verify a password once, then read the item with a cheap HMAC check ---
+UNLOCK_TOKEN_TTL_SECONDS = 60 * 60
+_UNLOCK_KEY = None
+
+def _unlock_signing_key():
+    # Unlike the office key this can't come from the installation id, which is reported to analytics
+    global _UNLOCK_KEY
+    if _UNLOCK_KEY is None:
+        secret = _config.get('unlock_secret')
+        if not secret:
+            secret = secrets.token_hex(32)
+            _config['unlock_secret'] = secret
+            save_config(_config)
+        _UNLOCK_KEY = hashlib.sha256(secret.encode('utf-8') + b'|unlock|v1').digest()
+    return _UNLOCK_KEY
+
+def _password_fingerprint(password_hash):
+    # Bound into the token so changing or removing the password revokes outstanding tokens
+    return hashlib.sha256((password_hash or '').encode('utf-8')).hexdigest()[:16]
+
+def _make_unlock_token(kind, name, password_hash, expires_at):
+    return _sign_token(_unlock_signing_key(), {'k': kind, 'n': name, 'h': _password_fingerprint(password_hash), 'e': int(expires_at)})
+
+def _request_unlock_token():
+    return request.headers.get('X-Unlock-Token') or request.values.get('token') or (request.get_json(silent=True) or {}).get('token')
+
+def _can_access(kind, name, password_hash, password=None, token=None):
+    """Whether the request may read a protected file or text: a matching unlock token, else the password."""
+    if not password_hash:
+        return True
+    token = token or _request_unlock_token()
+    if token:
+        obj = _verify_signed_token(_unlock_signing_key(), token)
+        if obj and obj.get('k') == kind and obj.get('n') == name and obj.get('h') == _password_fingerprint(password_hash):
+            return True
+    return bool(password) and _check_password_hash(password_hash, password)
+
+@app.route('/api/unlock', methods=['POST'])
+def api_unlock():
+    data = (request.get_json(silent=True) or (request.form.to_dict() if request.form else {}) or {})
+    password = data.get('password') or ''
+    meta = read_metadata()
+    if data.get('text_id'):
+        kind, name = 'text', str(data['text_id'])
+        entry = meta.get('__texts__', {}).get(name)
+    elif data.get('filename'):
+        kind, name = 'file', str(data['filename'])
+        entry = None if _is_protected_name(name) else meta.get(name)
+        if entry is None and os.path.isfile(_upload_path(name) or ''):
+            entry = {}
+    else:
+        return jsonify({'error': 'filename or text_id required'}), 400
+    if entry is None:
+        return jsonify({'error': 'not found'}), 404
+    password_hash = entry.get('password_hash')
+    if password_hash and (not password or not _check_password_hash(password_hash, password)):
+        return jsonify({'error': 'password required'}), 403
+    if not password_hash:
+        return jsonify({'token': None, 'protected': False})
+    try:
+        ttl = int(_config.get('unlock_token_ttl') or UNLOCK_TOKEN_TTL_SECONDS)
+    except Exception:
+        ttl = UNLOCK_TOKEN_TTL_SECONDS
+    expires_at = int(time.time()) + ttl
+    return jsonify({'token': _make_unlock_token(kind, name, password_hash, expires_at), 'expires_at': expires_at, 'protected': True})
+
 def _office_cache_key(src_path):
     try:
         st = os.stat(src_path)
@@ -1954,15 +3463,14 @@ def api_office_preview():
     password = data.get('password')
     if not filename:
         return jsonify({'error': 'filename required'}), 400
-    src_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    if not os.path.exists(src_path):
+    src_path = _upload_path(filename)
+    if not src_path or not os.path.exists(src_path):
         return jsonify({'error': 'not found'}), 404
     ext = os.path.splitext(filename)[1].lower().strip('.')
     if ext in ('doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx'):
-        meta = load_metadata()
+        meta = read_metadata()
         entry = meta.get(filename, {})
-        password_hash = entry.get('password_hash')
-        if password_hash and (not password or not _check_password_hash(password_hash, password)):
+        if not _can_access('file', filename, entry.get('password_hash'), password):
             return jsonify({'error': 'password required'}), 403
 
         out_pdf = _convert_office_to_pdf(src_path)
@@ -2035,6 +3543,45 @@ def open_browser():
         time.sleep(0.5)
     webbrowser.open(url)
 
+def run_production_server(port):
+    """Serve with gunicorn instead of the Werkzeug development server.
+
+    One worker process with a thread pool: uploads, sessions, reservations and
+    the job queue live in this process's memory, so it must not be forked into
+    several workers. gunicorn hands send_file responses to os.sendfile via
+    wsgi.file_wrapper, so downloads no longer copy through Python.
+    Returns False if gunicorn is not available.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        return False
+
+    options = {
+        'bind': f'0.0.0.0:{port}',
+        'workers': 1,
+        'worker_class': 'gthread',
+        'threads': int(os.environ.get('QUICKSEND_THREADS') or 32),
+        'keepalive': 5,
+        'timeout': 120,
+        'graceful_timeout': 10,
+        'sendfile': True,
+        # Threads started before the fork are gone in the worker; start the watchers there
+        'post_worker_init': lambda worker: _start_background(),
+    }
+
+    class _Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    log(f"[启动] 生产模式: gunicorn gthread, 线程数: {options['threads']}")
+    _Server().run()
+    return True
+
 if __name__ == '__main__':
     # Decide port: Prefer PORT env, but fallback to scanning if busy
     # This ensures that even if a specific port is requested (via env), 
@@ -2065,13 +3612,18 @@ if __name__ == '__main__':
     log(f"[启动] 耗时: {int((time.time()-START_TIME)*1000)}ms, 端口: {GLOBAL_PORT}")
 
     def start_flask():
+        _start_background()
         app.run(host='0.0.0.0', port=GLOBAL_PORT, debug=False, threaded=True, use_reloader=False)
 
     # Check if we should run headless (e.g. server mode)
     headless = os.environ.get('HEADLESS', '').lower() in ('1', 'true', 'yes')
     
     if headless:
-        start_flask()
+        # QUICKSEND_SERVER=dev keeps the Werkzeug server, e.g. for debugging
+        if os.environ.get('QUICKSEND_SERVER', '').lower() == 'dev' or not run_production_server(GLOBAL_PORT):
+            if os.environ.get('QUICKSEND_SERVER', '').lower() != 'dev':
+                log('[启动] 未安装 gunicorn, 使用开发服务器')
+            start_flask()
     else:
         # Start Flask in background thread
         t = threading.Thread(target=start_flask, daemon=True)
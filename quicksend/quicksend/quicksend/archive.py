@@ -0,0 +1,95 @@
+import os
+import time
+import zipfile
+
+READ_SIZE = 1024 * 1024
+
+# Already-compressed formats: deflating them again costs CPU and saves nothing
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif', '.avif',
+    '.mp4', '.mov', '.m4v', '.mkv', '.webm', '.avi', '.3gp',
+    '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac',
+    '.zip', '.7z', '.rar', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.apk', '.ipa', '.dmg',
+    '.pdf', '.docx', '.xlsx', '.pptx',
+}
+
+
+class _StreamSink:
+    """Write-only target for ZipFile that buffers output until it is drained.
+
+    It has ``tell`` but no ``seek``, which makes zipfile write data descriptors
+    after each member instead of seeking back to patch the local headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+        self.pending = 0
+
+    def write(self, data):
+        n = len(data)
+        if n:
+            self._chunks.append(bytes(data))
+            self._pos += n
+            self.pending += n
+        return n
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.pending = 0
+        return data
+
+
+def _zip_date(ts):
+    t = time.localtime(ts)
+    if t.tm_year < 1980:
+        return (1980, 1, 1, 0, 0, 0)
+    return t[:6]
+
+
+def compress_type_for(name):
+    return zipfile.ZIP_STORED if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def iter_zip(members, read_size=READ_SIZE, flush_size=READ_SIZE):
+    """Yield a ZIP archive of ``members`` (``(arcname, path)`` pairs) while it is being built.
+
+    Nothing is staged on disk and at most about ``flush_size`` bytes of output
+    are buffered. Members larger than 4 GiB, and archives with more than 65535
+    entries, get ZIP64 records. Files that vanish before they are reached are
+    left out.
+    """
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+        for arcname, path in members:
+            try:
+                f = open(path, 'rb')
+            except OSError:
+                continue
+            with f:
+                st = os.fstat(f.fileno())
+                info = zipfile.ZipInfo(arcname, _zip_date(st.st_mtime))
+                info.file_size = st.st_size
+                info.compress_type = compress_type_for(arcname)
+                info.external_attr = 0o644 << 16
+                with zf.open(info, 'w') as out:
+                    while True:
+                        buf = f.read(read_size)
+                        if not buf:
+                            break
+                        out.write(buf)
+                        if sink.pending >= flush_size:
+                            yield sink.drain()
+            if sink.pending:
+                yield sink.drain()
+    # Closing the archive wrote the central directory
+    tail = sink.drain()
+    if tail:
+        yield tail
@@ -0,0 +1,251 @@
+import hashlib
+import heapq
+import json
+import os
+import secrets
+import threading
+import time
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class AuthStore:
+    """Users and login sessions kept in memory, persisted through an append-only journal.
+
+    ``users.json`` (username -> password hash) and ``sessions.json`` (token
+    hash -> ``{"user", "expires"}``) are snapshots; every change appends one
+    line to ``auth.journal`` next to them, so a login or logout costs one
+    small append however many sessions exist. The journal is folded into the
+    snapshots once it grows past ``compact_ops`` lines.
+
+    Only SHA-256 hashes of session tokens are stored. Sessions expire after
+    ``ttl_seconds``; an expiry heap lets the sweeper drop them without
+    scanning. Old ``sessions.json`` files mapping raw tokens to usernames
+    are converted on load and their sessions get a fresh TTL.
+    """
+
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, users_path, sessions_path, ttl_seconds=30 * 24 * 3600, compact_ops=1000):
+        self.users_path = users_path
+        self.sessions_path = sessions_path
+        self.journal_path = os.path.join(os.path.dirname(sessions_path), 'auth.journal')
+        self._ttl = ttl_seconds
+        self._compact_ops = compact_ops
+        self._lock = threading.RLock()
+        self._users = {}
+        self._sessions = {}
+        self._loaded = False
+        self._expiry = []
+        self._journal = None
+        self._ops = 0
+        self._logger = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def set_logger(self, logger):
+        self._logger = logger
+
+    def _log(self, msg):
+        try:
+            if self._logger:
+                self._logger(msg)
+        except Exception:
+            pass
+
+    def set_ttl(self, ttl_seconds):
+        self._ttl = ttl_seconds
+
+    # --- loading ---
+    def _read_json(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+            data = json.loads(content) if content else {}
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self._log(f'[账号] 读取失败 {path}: {e}')
+            return {}
+
+    def _apply(self, rec):
+        op = rec.get('op')
+        if op == 'user':
+            self._users[rec['name']] = rec['hash']
+        elif op == 'add':
+            self._sessions[rec['h']] = {'user': rec['u'], 'expires': rec['e']}
+            heapq.heappush(self._expiry, (rec['e'], rec['h']))
+        elif op == 'del':
+            self._sessions.pop(rec['h'], None)
+
+    def _replay(self, path):
+        count = 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        self._log(f'[账号] 日志末尾不完整, 已忽略: {path}')
+                        break
+                    self._apply(rec)
+                    count += 1
+        except FileNotFoundError:
+            pass
+        return count
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._users = self._read_json(self.users_path)
+            now = time.time()
+            converted = 0
+            for key, value in self._read_json(self.sessions_path).items():
+                if isinstance(value, dict):
+                    self._sessions[key] = value
+                else:
+                    # Legacy format: raw token -> username
+                    self._sessions[hash_token(key)] = {'user': value, 'expires': now + self._ttl}
+                    converted += 1
+            for h, s in self._sessions.items():
+                heapq.heappush(self._expiry, (s['expires'], h))
+            self._ops = self._replay(self.journal_path + '.1') + self._replay(self.journal_path)
+            self._sweep(now)
+            self._log(f'[账号] 加载成功: {len(self._users)} 个账号, {len(self._sessions)} 个会话')
+            self._loaded = True
+            if converted:
+                self._log(f'[账号] 已转换旧会话: {converted} 个')
+                self.compact()
+            threading.Thread(target=self._sweep_loop, daemon=True).start()
+
+    def _after_fork(self):
+        # The sweeper thread does not survive fork; restart it in the child if it was running
+        self._lock = threading.RLock()
+        if self._loaded:
+            threading.Thread(target=self._sweep_loop, daemon=True).start()
+
+    # --- persistence ---
+    def _append(self, rec):
+        line = json.dumps(rec, ensure_ascii=False, separators=(',', ':')) + '\n'
+        if self._journal is None:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal.write(line)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._ops += 1
+
+    def _write_snapshot(self, path, data):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def compact(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            rotated = self.journal_path + '.1'
+            try:
+                if os.path.exists(self.journal_path):
+                    if os.path.exists(rotated):
+                        with open(rotated, 'a', encoding='utf-8') as dst, open(self.journal_path, 'r', encoding='utf-8') as src:
+                            dst.write(src.read())
+                        os.remove(self.journal_path)
+                    else:
+                        os.replace(self.journal_path, rotated)
+                os.makedirs(os.path.dirname(self.sessions_path), exist_ok=True)
+                self._write_snapshot(self.users_path, self._users)
+                self._write_snapshot(self.sessions_path, self._sessions)
+                if os.path.exists(rotated):
+                    os.remove(rotated)
+                self._ops = 0
+                return True
+            except Exception as e:
+                self._log(f'[账号] 快照写入失败: {e}')
+                return False
+
+    # --- expiry ---
+    def _sweep(self, now):
+        dropped = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, h = heapq.heappop(self._expiry)
+            s = self._sessions.get(h)
+            # Stale heap entries (logged out or re-added) are skipped
+            if s is not None and s['expires'] == expires:
+                del self._sessions[h]
+                dropped += 1
+        return dropped
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.SWEEP_INTERVAL)
+            try:
+                with self._lock:
+                    dropped = self._sweep(time.time())
+                    if dropped:
+                        self._log(f'[账号] 清理过期会话: {dropped} 个')
+                    if self._ops >= self._compact_ops:
+                        self.compact()
+            except Exception as e:
+                self._log(f'[账号] 后台清理失败: {e}')
+
+    # --- API ---
+    def get_user_hash(self, username):
+        self._ensure_loaded()
+        return self._users.get(username)
+
+    def set_user(self, username, password_hash):
+        self._ensure_loaded()
+        with self._lock:
+            self._append({'op': 'user', 'name': username, 'hash': password_hash})
+            self._users[username] = password_hash
+
+    def create_session(self, username):
+        """Start a session; the raw token is returned once and only its hash is kept."""
+        self._ensure_loaded()
+        token = secrets.token_urlsafe(32)
+        h = hash_token(token)
+        expires = time.time() + self._ttl
+        with self._lock:
+            self._append({'op': 'add', 'h': h, 'u': username, 'e': expires})
+            self._sessions[h] = {'user': username, 'expires': expires}
+            heapq.heappush(self._expiry, (expires, h))
+        return token
+
+    def session_user(self, token):
+        if not token:
+            return None
+        self._ensure_loaded()
+        s = self._sessions.get(hash_token(token))
+        if s is None or s['expires'] <= time.time():
+            return None
+        return s['user']
+
+    def end_session(self, token):
+        if not token:
+            return False
+        self._ensure_loaded()
+        h = hash_token(token)
+        with self._lock:
+            if h not in self._sessions:
+                return False
+            self._append({'op': 'del', 'h': h})
+            del self._sessions[h]
+        return True
+
+    def stats(self):
+        self._ensure_loaded()
+        return {'users': len(self._users), 'sessions': len(self._sessions), 'journal_ops': self._ops}
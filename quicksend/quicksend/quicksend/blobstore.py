@@ -0,0 +1,100 @@
+import hashlib
+import os
+import threading
+import uuid
+
+READ_SIZE = 1024 * 1024
+
+
+def file_digest(path, hash_name='sha256'):
+    h = hashlib.new(hash_name)
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(READ_SIZE)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def head_tail_digests(path, size, chunk_size, hash_name='sha256'):
+    with open(path, 'rb') as f:
+        head = hashlib.new(hash_name, f.read(min(chunk_size, size))).hexdigest()
+        f.seek(max(0, size - chunk_size))
+        tail = hashlib.new(hash_name, f.read(chunk_size)).hexdigest()
+    return head, tail
+
+
+class BlobStore:
+    """Content-addressed storage for the upload folder.
+
+    Every distinct content is kept once as ``<root>/<aa>/<digest>``, and the
+    user-visible files are hard links to it. The blob's link count is the
+    reference count: when only the blob's own link is left, nothing refers to
+    it any more and it can be removed.
+    """
+
+    def __init__(self, root_getter):
+        self._root_getter = root_getter
+        self._lock = threading.Lock()
+        self._logger = None
+
+    def set_logger(self, logger):
+        self._logger = logger
+
+    def _log(self, msg):
+        try:
+            if self._logger:
+                self._logger(msg)
+        except Exception:
+            pass
+
+    def _valid_digest(self, digest):
+        return bool(digest) and len(digest) == 64 and all(c in '0123456789abcdef' for c in digest)
+
+    def blob_path(self, digest):
+        return os.path.join(self._root_getter(), digest[:2], digest)
+
+    def has(self, digest):
+        return self._valid_digest(digest) and os.path.isfile(self.blob_path(digest))
+
+    def ingest(self, path, digest):
+        """Store ``path`` under ``digest`` and turn ``path`` into a link to it.
+
+        Returns False (leaving ``path`` untouched) when the volume cannot hard
+        link, e.g. exFAT or some SMB shares.
+        """
+        if not self._valid_digest(digest):
+            return False
+        bp = self.blob_path(digest)
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(bp), exist_ok=True)
+                if os.path.isfile(bp):
+                    if os.path.samefile(bp, path):
+                        return True
+                    # Known content: swap the freshly written copy for a link to the existing blob
+                    tmp = f'{path}.{uuid.uuid4().hex[:8]}.link'
+                    os.link(bp, tmp)
+                    os.replace(tmp, path)
+                    self._log(f'[去重] 复用已有内容: {os.path.basename(path)} -> {digest[:12]}')
+                else:
+                    os.link(path, bp)
+                return True
+            except Exception as e:
+                self._log(f'[去重] 硬链接失败, 保留独立文件: {os.path.basename(path)}: {e}')
+                return False
+
+    def release(self, digest):
+        if not self._valid_digest(digest):
+            return False
+        bp = self.blob_path(digest)
+        with self._lock:
+            try:
+                if os.stat(bp).st_nlink <= 1:
+                    os.remove(bp)
+                    self._log(f'[去重] 释放内容: {digest[:12]}')
+                    return True
+            except OSError:
+                pass
+        return False
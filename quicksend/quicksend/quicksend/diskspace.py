@@ -0,0 +1,89 @@
+import shutil
+import threading
+import uuid
+
+
+class DiskSpaceGuard:
+    """Admission control for writes into the upload folder.
+
+    Free space is what the volume reports, minus a safety margin, minus bytes
+    already promised to in-flight uploads: explicit reservations taken by
+    running requests plus whatever ``pending_getter`` reports (the unreceived
+    remainder of open upload sessions). A reservation shrinks through
+    ``consume`` as its bytes land on disk, since from then on they are
+    already gone from the volume's free space, and grows back (never past
+    what was reserved) when a negative count returns space, e.g. an unused
+    preallocation that was truncated away.
+    """
+
+    def __init__(self, root_getter, pending_getter=None, margin_getter=None):
+        self._root_getter = root_getter
+        self._pending_getter = pending_getter
+        self._margin_getter = margin_getter
+        self._lock = threading.Lock()
+        self._reservations = {}
+
+    def free_bytes(self):
+        return shutil.disk_usage(self._root_getter()).free
+
+    def reserved_bytes(self):
+        total = sum(left for left, _ in self._reservations.values())
+        if self._pending_getter:
+            try:
+                total += int(self._pending_getter() or 0)
+            except Exception:
+                pass
+        return total
+
+    def _margin(self):
+        try:
+            return int(self._margin_getter() or 0) if self._margin_getter else 0
+        except Exception:
+            return 0
+
+    def available_bytes(self):
+        return max(0, self.free_bytes() - self._margin() - self.reserved_bytes())
+
+    def check(self, nbytes):
+        try:
+            available = self.available_bytes()
+        except Exception:
+            # Can't stat the volume: don't block uploads on it
+            return True, None
+        return nbytes <= available, available
+
+    def try_reserve(self, nbytes):
+        """Reserve ``nbytes``; returns ``(token, available)``, token is None if it does not fit."""
+        with self._lock:
+            ok, available = self.check(nbytes)
+            if not ok:
+                return None, available
+            token = uuid.uuid4().hex
+            self._reservations[token] = [int(nbytes), int(nbytes)]
+            return token, available
+
+    def consume(self, token, nbytes):
+        if not token or not nbytes:
+            return
+        with self._lock:
+            held = self._reservations.get(token)
+            if held is not None:
+                held[0] = min(held[1], max(0, held[0] - int(nbytes)))
+
+    def release(self, token):
+        if not token:
+            return
+        with self._lock:
+            self._reservations.pop(token, None)
+
+    def status(self):
+        try:
+            free = self.free_bytes()
+        except Exception:
+            free = None
+        return {
+            'free': free,
+            'margin': self._margin(),
+            'reserved': self.reserved_bytes(),
+            'available': (max(0, free - self._margin() - self.reserved_bytes()) if free is not None else None),
+        }
@@ -0,0 +1,121 @@
+import collections
+import os
+import threading
+import time
+import uuid
+
+
+class EventBus:
+    """In-process change feed with monotonically increasing sequence numbers.
+
+    The last ``capacity`` events are kept in a ring buffer so a client that
+    reconnects with its last seen sequence gets exactly what it missed; if
+    that has already been overwritten, ``since`` reports a reset and the
+    client reloads its lists instead. Ids handed to clients carry a per-boot
+    prefix (``event_id``), since the counter restarts with the process: an id
+    from an earlier boot parses to ``STALE`` and also gets a reset.
+    """
+
+    STALE = -1
+
+    def __init__(self, capacity=2000):
+        self._cond = threading.Condition()
+        self._buffer = collections.deque(maxlen=capacity)
+        self._seq = 0
+        self._streams = 0
+        self.boot = uuid.uuid4().hex[:8]
+        self._logger = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A forked worker numbers its own events, so it must not reuse the parent's boot id
+        self._cond = threading.Condition()
+        self._streams = 0
+        self.boot = uuid.uuid4().hex[:8]
+
+    def set_logger(self, logger):
+        self._logger = logger
+
+    def _log(self, msg):
+        try:
+            if self._logger:
+                self._logger(msg)
+        except Exception:
+            pass
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def event_id(self, seq):
+        return f'{self.boot}-{seq}'
+
+    def parse_id(self, raw):
+        """Sequence number of an ``event_id``; ``STALE`` for one from another boot. Raises ValueError if malformed."""
+        boot, sep, seq = str(raw).strip().rpartition('-')
+        seq = int(seq)
+        if not sep or boot != self.boot or seq < 0:
+            return self.STALE
+        return seq
+
+    def publish(self, kind, action, ident, **extra):
+        with self._cond:
+            self._seq += 1
+            event = {'seq': self._seq, 'type': kind, 'action': action, 'id': ident, 'ts': time.time()}
+            event.update(extra)
+            self._buffer.append(event)
+            self._cond.notify_all()
+            return self._seq
+
+    def since(self, seq):
+        """Return ``(events, reset)`` for everything after ``seq``."""
+        with self._cond:
+            return self._since(seq)
+
+    def _since(self, seq):
+        if seq == self.STALE:
+            return list(self._buffer), True
+        if seq > self._seq:
+            # The counter restarted with the process; the client's position means nothing now
+            return [], True
+        if not self._buffer or seq >= self._seq:
+            return [], False
+        oldest = self._buffer[0]['seq']
+        if seq < oldest - 1:
+            return list(self._buffer), True
+        return [e for e in self._buffer if e['seq'] > seq], False
+
+    def wait(self, seq, timeout):
+        """Block until there are events after ``seq`` or ``timeout`` passes."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events, reset = self._since(seq)
+                if events or reset:
+                    return events, reset
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], False
+                self._cond.wait(remaining)
+
+    def open_stream(self, limit):
+        """Count a long-lived stream; returns False when ``limit`` streams are already open."""
+        with self._cond:
+            if limit and self._streams >= limit:
+                return False
+            self._streams += 1
+            return True
+
+    def close_stream(self):
+        with self._cond:
+            self._streams = max(0, self._streams - 1)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'seq': self._seq,
+                'buffered': len(self._buffer),
+                'oldest': self._buffer[0]['seq'] if self._buffer else None,
+                'streams': self._streams,
+            }
@@ -0,0 +1,278 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+
+# inotify(7) event bits
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT = struct.Struct('iIII')
+
+
+class _Inotify:
+    """Minimal ctypes binding: one watch on one directory."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, 'inotify_add_watch failed')
+
+    def read(self, timeout):
+        """Return ``(names, overflow)`` for events within ``timeout``; names are str."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set(), False
+        buf = os.read(self.fd, 64 * 1024)
+        names = set()
+        overflow = False
+        pos = 0
+        while pos + _EVENT.size <= len(buf):
+            _, mask, _, length = _EVENT.unpack_from(buf, pos)
+            pos += _EVENT.size
+            name = buf[pos:pos + length].rstrip(b'\0')
+            pos += length
+            if mask & (IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                overflow = True
+            elif name:
+                names.add(os.fsdecode(name))
+        return names, overflow
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+class FileIndex:
+    """In-memory index of the regular files directly inside the upload folder.
+
+    Built with one ``os.scandir`` pass and kept current three ways: the
+    upload and delete paths call ``refresh`` for the names they touch, an
+    inotify watch (Linux) reports everything else, and where inotify is
+    unavailable the folder's mtime is polled. A full rescan every
+    ``rescan_interval`` seconds also catches changes no event reports, such
+    as files edited on a network share by another machine.
+
+    ``version`` increases on every change, so callers can cache anything
+    derived from the listing, and listeners added with ``add_listener`` are
+    told which names appeared or disappeared.
+
+    With a ``layout`` (see storagelayout) files stored in hash-prefixed
+    subdirectories are indexed under their flat names as well; only the
+    top folder is watched, the shards are kept current by ``refresh`` and
+    the periodic rescan.
+    """
+
+    def __init__(self, root_getter, poll_interval=2.0, rescan_interval=60.0, layout=None):
+        self._root_getter = root_getter
+        self._layout = layout
+        self._poll_interval = poll_interval
+        self._rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._root = None
+        self._dir_mtime = None
+        self._last_scan = 0
+        self._watcher = None
+        self._mode = 'poll'
+        self.version = 0
+        self._listeners = []
+        self._logger = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def set_logger(self, logger):
+        self._logger = logger
+
+    def _log(self, msg):
+        try:
+            if self._logger:
+                self._logger(msg)
+        except Exception:
+            pass
+
+    def add_listener(self, fn, replay=True):
+        """Call ``fn(added, removed)`` with name lists on every change; it runs under the index lock.
+
+        With ``replay`` the current names are first passed as added.
+        """
+        with self._lock:
+            if replay:
+                fn(list(self._entries), [])
+            self._listeners.append(fn)
+
+    def _notify(self, added, removed):
+        for fn in self._listeners:
+            try:
+                fn(added, removed)
+            except Exception as e:
+                self._log(f'[索引] 通知失败: {e}')
+
+    def start(self):
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self.rescan()
+        self._watcher = threading.Thread(target=self._watch_loop, daemon=True)
+        self._watcher.start()
+
+    def _after_fork(self):
+        # The watcher thread does not survive fork; a child of a started index watches on its own
+        self._lock = threading.Lock()
+        if self._watcher is not None:
+            self._watcher = threading.Thread(target=self._watch_loop, daemon=True)
+            self._watcher.start()
+
+    def _ensure_root(self):
+        root = self._root_getter()
+        if root != self._root:
+            self.rescan()
+
+    # --- maintenance ---
+    def rescan(self):
+        root = self._root_getter()
+        t0 = time.time()
+        entries = {}
+        try:
+            dir_mtime = os.stat(root).st_mtime_ns
+            if self._layout is not None:
+                entries = self._layout.scan(root)
+            else:
+                with os.scandir(root) as it:
+                    for de in it:
+                        try:
+                            if de.is_file():
+                                entries[de.name] = de.stat()
+                        except OSError:
+                            continue
+        except OSError:
+            dir_mtime = None
+        with self._lock:
+            changed = root != self._root or self._stat_keys(entries) != self._stat_keys(self._entries)
+            added = [n for n in entries if n not in self._entries]
+            removed = [n for n in self._entries if n not in entries]
+            self._entries = entries
+            self._root = root
+            self._dir_mtime = dir_mtime
+            self._last_scan = time.time()
+            if changed:
+                self.version += 1
+            if added or removed:
+                self._notify(added, removed)
+        if changed:
+            self._log(f'[索引] 扫描完成: {root}, 共 {len(entries)} 个文件, 耗时 {int((time.time() - t0) * 1000)}ms')
+
+    @staticmethod
+    def _stat_keys(entries):
+        return {name: (st.st_size, st.st_mtime_ns) for name, st in entries.items()}
+
+    def refresh(self, name):
+        """Re-stat one file after it was written, renamed or removed."""
+        root = self._root
+        if not root or not name or os.sep in name or (os.altsep and os.altsep in name):
+            return
+        if self._layout is not None:
+            self._layout.invalidate(name)
+        try:
+            path = self._layout.path(name) if self._layout is not None else os.path.join(root, name)
+            st = os.stat(path) if path else None
+            if st is not None and not stat.S_ISREG(st.st_mode):
+                st = None
+        except OSError:
+            st = None
+        with self._lock:
+            if root != self._root:
+                return
+            old = self._entries.get(name)
+            if st is None:
+                if old is not None:
+                    del self._entries[name]
+                    self.version += 1
+                    self._notify([], [name])
+            elif old is None or (old.st_size, old.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                self._entries[name] = st
+                self.version += 1
+                if old is None:
+                    self._notify([name], [])
+
+    # --- reading ---
+    def get(self, name):
+        self._ensure_root()
+        return self._entries.get(name)
+
+    def items(self):
+        """``(name, stat_result)`` pairs as of now."""
+        self._ensure_root()
+        with self._lock:
+            return list(self._entries.items())
+
+    def stats(self):
+        return {'root': self._root, 'files': len(self._entries), 'version': self.version, 'mode': self._mode}
+
+    # --- watching ---
+    def _open_inotify(self, root):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            return _Inotify(root)
+        except Exception as e:
+            self._log(f'[索引] inotify 不可用, 改为轮询: {e}')
+            return None
+
+    def _watch_loop(self):
+        watch = None
+        watched_root = None
+        while True:
+            try:
+                root = self._root_getter()
+                if root != watched_root:
+                    if watch:
+                        watch.close()
+                    # Watch first, then scan, so nothing slips in between
+                    watch = self._open_inotify(root)
+                    self.rescan()
+                    watched_root = root
+                    self._mode = 'inotify' if watch else 'poll'
+                if watch:
+                    names, overflow = watch.read(self._poll_interval)
+                    if overflow:
+                        watch.close()
+                        watch = None
+                        watched_root = None
+                        continue
+                    for name in names:
+                        self.refresh(name)
+                else:
+                    time.sleep(self._poll_interval)
+                    try:
+                        dir_mtime = os.stat(root).st_mtime_ns
+                    except OSError:
+                        dir_mtime = None
+                    if dir_mtime != self._dir_mtime:
+                        self.rescan()
+                if self._rescan_interval and time.time() - self._last_scan >= self._rescan_interval:
+                    self.rescan()
+            except Exception as e:
+                self._log(f'[索引] 监视失败: {e}')
+                time.sleep(self._poll_interval)
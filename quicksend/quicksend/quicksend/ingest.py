@@ -0,0 +1,350 @@
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import sys
+import zlib
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.sansio.multipart import Epilogue, MultipartDecoder, NeedData
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_SIZE = 1024 * 1024
+MAX_FIELD_SIZE = 1024 * 1024
+
+DURABILITY_MODES = ('none', 'finalize', 'periodic')
+
+_FALLOC_FL_KEEP_SIZE = 0x01
+_fallocate = None
+if sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _fallocate = _libc.fallocate
+        _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        _fallocate.restype = ctypes.c_int
+    except Exception:
+        _fallocate = None
+
+
+def preallocate(fd, size, offset=0):
+    """Reserve ``size`` bytes of contiguous space for ``fd`` without changing its length.
+
+    Uses Linux fallocate(2) with FALLOC_FL_KEEP_SIZE. posix_fallocate is
+    deliberately not used: where the filesystem can't allocate (exFAT on older
+    kernels, some network mounts) glibc falls back to writing every block,
+    which is slower than not preallocating at all. Returns False if nothing
+    was reserved.
+    """
+    if _fallocate is None or not size or size <= 0:
+        return False
+    try:
+        return _fallocate(fd, _FALLOC_FL_KEEP_SIZE, offset, size) == 0
+    except Exception:
+        return False
+
+
+def fsync_dir(path):
+    # Makes a new or renamed directory entry durable; not possible (nor needed) on Windows
+    if os.name == 'nt':
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class UploadWriter:
+    """Writes an incoming upload into ``path``, normally a temp file on the same volume.
+
+    The file is created exclusively and ``abort`` removes whatever was
+    written; the caller renames the finished file to its real name, so it is
+    written once and never visible half-done. With ``hash_name`` the content
+    digest is computed on the fly, so no second read pass is needed.
+
+    ``expected_size`` (exact or an upper bound) is preallocated up front and
+    any unused tail is given back on ``close``. ``on_allocate(n)`` is told
+    each time the file takes ``n`` more bytes of disk (the preallocation,
+    then writes past it), and with a negative ``n`` when ``close`` gives
+    that tail back. ``durability`` is one of
+    ``DURABILITY_MODES``: ``none`` leaves flushing to the OS, ``finalize``
+    fsyncs the file and its directory on ``close``, and ``periodic`` also
+    fsyncs every ``sync_every`` bytes so dirty pages never pile up.
+    """
+
+    def __init__(self, path, hash_name=None, expected_size=None, durability='none', sync_every=None, on_allocate=None):
+        self.path = path
+        self.size = 0
+        self._hasher = hashlib.new(hash_name) if hash_name else None
+        self._durability = durability if durability in DURABILITY_MODES else 'none'
+        self._sync_every = sync_every if self._durability == 'periodic' and sync_every and sync_every > 0 else None
+        self._unsynced = 0
+        self._on_allocate = on_allocate
+        self._f = open(path, 'xb')
+        self._preallocated = preallocate(self._f.fileno(), expected_size) if expected_size else False
+        self._allocated = 0
+        if self._preallocated:
+            self._allocate(expected_size)
+
+    def _allocate(self, nbytes):
+        self._allocated += nbytes
+        if self._on_allocate is not None:
+            try:
+                self._on_allocate(nbytes)
+            except Exception:
+                pass
+
+    def write(self, data):
+        if data:
+            self._f.write(data)
+            self.size += len(data)
+            if self.size > self._allocated:
+                self._allocate(self.size - self._allocated)
+            if self._hasher is not None:
+                self._hasher.update(data)
+            if self._sync_every:
+                self._unsynced += len(data)
+                if self._unsynced >= self._sync_every:
+                    self._sync()
+
+    def _sync(self):
+        self._f.flush()
+        getattr(os, 'fdatasync', os.fsync)(self._f.fileno())
+        self._unsynced = 0
+
+    def hexdigest(self):
+        return self._hasher.hexdigest() if self._hasher is not None else None
+
+    def close(self):
+        if self._f is None:
+            return
+        try:
+            self._f.flush()
+            if self._preallocated:
+                # Release blocks reserved past what actually arrived
+                self._f.truncate(self.size)
+                if self._allocated > self.size:
+                    self._allocate(self.size - self._allocated)
+            if self._durability != 'none':
+                os.fsync(self._f.fileno())
+        finally:
+            self._f.close()
+            self._f = None
+        if self._durability != 'none':
+            fsync_dir(os.path.dirname(os.path.abspath(self.path)))
+
+    def abort(self):
+        try:
+            if self._f is not None:
+                self._f.close()
+        except Exception:
+            pass
+        self._f = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def copy_from(self, stream, read_size=READ_SIZE):
+        while True:
+            buf = stream.read(read_size)
+            if not buf:
+                break
+            self.write(buf)
+        return self.size
+
+
+class CountingReader:
+    """Read-through wrapper that counts how many body bytes have been consumed."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        buf = self._stream.read(size)
+        if buf:
+            self.count += len(buf)
+        return buf
+
+
+def iter_multipart(stream, boundary, read_size=READ_SIZE):
+    """Incrementally parse a multipart body, yielding Werkzeug sans-io events.
+
+    Only one ``read_size`` block (plus the decoder's boundary look-behind) is
+    held in memory at a time, so file parts can be written out as they arrive.
+    """
+    # No max_form_memory_size here: it would count the read block itself; callers cap field sizes
+    decoder = MultipartDecoder(boundary)
+    while True:
+        chunk = stream.read(read_size)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, NeedData):
+            yield event
+            if isinstance(event, Epilogue):
+                return
+            event = decoder.next_event()
+        if not chunk:
+            return
+
+
+class DecompressionLimitError(RequestEntityTooLarge):
+    description = 'Decompressed body exceeds the allowed size.'
+
+
+class CorruptEncodingError(BadRequest):
+    description = 'Body could not be decoded with its Content-Encoding.'
+
+
+def supported_encodings():
+    encodings = ['gzip', 'x-gzip', 'deflate']
+    if zstandard is not None:
+        encodings.append('zstd')
+    return encodings
+
+
+def _zlib_wbits(encoding):
+    # gzip framing for gzip, zlib framing (auto-detected with raw deflate fallback below) for deflate
+    return 16 + zlib.MAX_WBITS if encoding in ('gzip', 'x-gzip') else zlib.MAX_WBITS
+
+
+class DecodingReader:
+    """File-like view of a compressed request body that decompresses on read.
+
+    Output is produced at most ``size`` bytes per read, so a small body that
+    inflates to gigabytes never sits in memory, and reading stops with
+    ``DecompressionLimitError`` once ``limit`` decompressed bytes are exceeded.
+    """
+
+    def __init__(self, stream, encoding, limit=None, read_size=READ_SIZE):
+        self._stream = stream
+        self._encoding = encoding
+        self._limit = limit
+        self._read_size = read_size
+        self._count = 0
+        self._eof = False
+        self._z = None
+        self._zr = None
+        if encoding == 'zstd':
+            self._zr = zstandard.ZstdDecompressor().stream_reader(stream, read_size=read_size, read_across_frames=True)
+        else:
+            self._z = zlib.decompressobj(_zlib_wbits(encoding))
+        self._pending = b''
+
+    def _read_zlib(self, size):
+        while not self._eof:
+            data = self._z.unconsumed_tail or self._pending
+            self._pending = b''
+            if not data:
+                data = self._stream.read(self._read_size)
+                if not data:
+                    self._eof = True
+                    if not self._z.eof and self._count:
+                        raise CorruptEncodingError()
+                    return self._z.flush()
+            try:
+                out = self._z.decompress(data, size)
+            except zlib.error:
+                if self._encoding == 'deflate' and not self._count and not self._z.eof:
+                    # Some clients send raw deflate without the zlib header
+                    self._z = zlib.decompressobj(-zlib.MAX_WBITS)
+                    self._pending = data
+                    continue
+                raise CorruptEncodingError()
+            if self._z.eof and self._z.unused_data:
+                # Concatenated gzip members (e.g. appended log chunks) decode as one stream
+                self._pending = self._z.unused_data
+                self._z = zlib.decompressobj(_zlib_wbits(self._encoding))
+            if out:
+                return out
+        return b''
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                buf = self.read(self._read_size)
+                if not buf:
+                    return b''.join(chunks)
+                chunks.append(buf)
+        if size == 0:
+            return b''
+        if self._zr is not None:
+            try:
+                out = self._zr.read(size)
+            except zstandard.ZstdError:
+                raise CorruptEncodingError()
+        else:
+            out = self._read_zlib(size)
+        self._count += len(out)
+        if self._limit is not None and self._count > self._limit:
+            raise DecompressionLimitError()
+        return out
+
+
+class PartDecoder:
+    """Push-style decoder for a single multipart part with its own Content-Encoding.
+
+    Decompressed output is handed to ``write`` in pieces of at most
+    ``READ_SIZE`` bytes as compressed data is fed in.
+    """
+
+    def __init__(self, encoding, write, limit=None):
+        self._encoding = encoding
+        self._write = write
+        self._limit = limit
+        self._count = 0
+        self._z = None
+        self._zw = None
+        if encoding == 'zstd':
+            self._zw = zstandard.ZstdDecompressor().stream_writer(self, write_size=READ_SIZE, write_return_read=True, closefd=False)
+        else:
+            self._z = zlib.decompressobj(_zlib_wbits(encoding))
+
+    def write(self, out):
+        # Sink for the zstd stream writer, and the common output path
+        if out:
+            self._count += len(out)
+            if self._limit is not None and self._count > self._limit:
+                raise DecompressionLimitError()
+            self._write(out)
+        return len(out)
+
+    def feed(self, data):
+        if not data:
+            return
+        if self._zw is not None:
+            try:
+                self._zw.write(data)
+            except zstandard.ZstdError:
+                raise CorruptEncodingError()
+            return
+        while data:
+            try:
+                self.write(self._z.decompress(data, READ_SIZE))
+            except zlib.error:
+                raise CorruptEncodingError()
+            data = self._z.unconsumed_tail
+            if self._z.eof and self._z.unused_data:
+                data = self._z.unused_data
+                self._z = zlib.decompressobj(_zlib_wbits(self._encoding))
+
+    def close(self):
+        if self._zw is not None:
+            try:
+                self._zw.flush()
+            except zstandard.ZstdError:
+                raise CorruptEncodingError()
+            return
+        if not self._z.eof:
+            raise CorruptEncodingError()
@@ -0,0 +1,127 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class JobQueue:
+    """Bounded queue of background jobs served by a pool of worker threads.
+
+    Jobs keep a small status record (queued / running / done / failed) that is
+    retained for the most recent ``keep`` jobs so clients can poll it.
+    """
+
+    def __init__(self, workers=None, maxsize=2000, keep=2000):
+        self._q = queue.Queue(maxsize=maxsize)
+        self._jobs = OrderedDict()
+        self._keep = keep
+        self._lock = threading.Lock()
+        self._threads = []
+        self._target = 0
+        self._logger = None
+        self.set_workers(workers or min(4, os.cpu_count() or 1))
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def set_logger(self, logger):
+        self._logger = logger
+
+    def _log(self, msg):
+        try:
+            if self._logger:
+                self._logger(msg)
+        except Exception:
+            pass
+
+    def set_workers(self, n):
+        n = max(1, int(n))
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            self._target = n
+            for _ in range(n - len(self._threads)):
+                t = threading.Thread(target=self._run, daemon=True)
+                t.start()
+                self._threads.append(t)
+        # Surplus workers exit when they notice the lower target
+        return n
+
+    def _after_fork(self):
+        # Threads do not survive fork (gunicorn forks its worker after importing the app): start new ones in the child
+        old = self._q
+        self._q = queue.Queue(maxsize=old.maxsize)
+        self._q.queue.extend(old.queue)
+        self._q.unfinished_tasks = len(self._q.queue)
+        self._lock = threading.Lock()
+        self._threads = []
+        self.set_workers(self._target)
+
+    def workers(self):
+        return self._target
+
+    def submit(self, kind, fn, *args, **kwargs):
+        jid = uuid.uuid4().hex
+        job = {
+            'id': jid,
+            'kind': kind,
+            'status': 'queued',
+            'result': None,
+            'error': None,
+            'created': time.time(),
+            'finished': None,
+        }
+        with self._lock:
+            self._jobs[jid] = job
+            while len(self._jobs) > self._keep:
+                oldest = next(iter(self._jobs))
+                if self._jobs[oldest]['status'] in ('queued', 'running'):
+                    break
+                self._jobs.popitem(last=False)
+        try:
+            self._q.put((job, fn, args, kwargs), timeout=5)
+        except queue.Full:
+            # Queue is saturated: do the work on the caller's thread rather than drop it
+            self._log(f'[任务] 队列已满, 同步执行: {kind}')
+            self._execute(job, fn, args, kwargs)
+        return jid
+
+    def get(self, jid):
+        with self._lock:
+            job = self._jobs.get(jid)
+            return dict(job) if job else None
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'workers': self._target, 'pending': self._q.qsize(), 'jobs': counts}
+
+    def _execute(self, job, fn, args, kwargs):
+        job['status'] = 'running'
+        try:
+            job['result'] = fn(*args, **kwargs)
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)[:300]
+            job['status'] = 'failed'
+            self._log(f"[任务] 执行失败: {job['kind']} {job['id']}: {e}")
+        job['finished'] = time.time()
+
+    def _run(self):
+        me = threading.current_thread()
+        while True:
+            with self._lock:
+                alive = [t for t in self._threads if t.is_alive()]
+                if len(alive) > self._target and me in alive:
+                    self._threads.remove(me)
+                    return
+            try:
+                job, fn, args, kwargs = self._q.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self._execute(job, fn, args, kwargs)
+            finally:
+                self._q.task_done()
@@ -0,0 +1,699 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from types import MappingProxyType
+
+# Top-level keys that hold a dict of records; they are journaled record by record
+CONTAINER_KEYS = ('__groups__', '__texts__')
+# Top-level keys that are sections rather than file entries
+SECTION_KEYS = ('__groups__', '__texts__', '__debug__')
+
+
+def is_file_entry(key, value):
+    return key not in SECTION_KEYS and isinstance(value, dict)
+
+
+def _copy_value(v):
+    # Structural copy of JSON data; scalars are immutable and shared
+    if type(v) is dict:
+        c = v.copy()
+        for k, x in c.items():
+            if type(x) is dict or type(x) is list:
+                c[k] = _copy_value(x)
+        return c
+    if type(v) is list:
+        return [_copy_value(x) if type(x) is dict or type(x) is list else x for x in v]
+    return v
+
+
+class MetaSnapshot(dict):
+    """A request's private view of the metadata.
+
+    Starts as a shallow copy of the live model and copies an entry the first
+    time it is read, so a request that touches one file pays for one entry,
+    and in-place edits never leak into the live model or other requests.
+    ``changes`` diffs against the entries as they were when the snapshot was
+    taken, so keys added meanwhile by other requests are left alone.
+    """
+
+    def __init__(self, base):
+        super().__init__(base)
+        self._base = base
+        self._owned = set()
+        self._deleted = set()
+
+    def _own(self, key):
+        if key in self._owned or not dict.__contains__(self, key):
+            return
+        self._owned.add(key)
+        value = dict.__getitem__(self, key)
+        if isinstance(value, (dict, list)):
+            dict.__setitem__(self, key, _copy_value(value))
+
+    def __getitem__(self, key):
+        self._own(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value):
+        self._owned.add(key)
+        self._deleted.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._deleted.add(key)
+
+    def setdefault(self, key, default=None):
+        if not dict.__contains__(self, key):
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if dict.__contains__(self, key):
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def items(self):
+        for key in list(dict.keys(self)):
+            self._own(key)
+        return dict.items(self)
+
+    def values(self):
+        for key in list(dict.keys(self)):
+            self._own(key)
+        return dict.values(self)
+
+    def changes(self):
+        """Return ``(sets, dels)``; paths are ``[key]`` or ``[container, record_id]``."""
+        sets, dels = [], []
+        for key in self._deleted:
+            if key in self._base and not dict.__contains__(self, key):
+                dels.append([key])
+        for key in self._owned:
+            if not dict.__contains__(self, key):
+                continue
+            value = dict.__getitem__(self, key)
+            old = self._base.get(key)
+            if key in CONTAINER_KEYS and isinstance(value, dict) and isinstance(old, dict):
+                for rid, rec in value.items():
+                    if rid not in old or old[rid] != rec:
+                        sets.append([[key, rid], rec])
+                for rid in old:
+                    if rid not in value:
+                        dels.append([key, rid])
+            elif key not in self._base or old != value:
+                sets.append([[key], value])
+        return sets, dels
+
+
+class MetadataStore:
+    """Process-wide metadata model backed by a JSON snapshot plus an append-only journal.
+
+    The snapshot (``metadata.json``) keeps its old format. Each save appends
+    one line with the changed entries to ``<snapshot>.journal`` instead of
+    rewriting the whole file; once the journal grows past ``compact_bytes``
+    or ``compact_ops`` a background thread folds it into a new snapshot.
+    Startup replays the journal on top of the snapshot, and a torn last line
+    from a crash is ignored.
+
+    All changes go through one writer thread. It collects whatever arrived
+    within ``BATCH_WINDOW`` of the first pending change, persists the batch
+    with a single fsync and only then wakes the callers, so concurrent saves
+    share one durable write and a returned save is on disk.
+
+    Values in the live model are never edited in place, only replaced, so
+    readers can hold references to them without locking.
+    """
+
+    FLUSH_INTERVAL = 1.0
+    BATCH_WINDOW = 0.005
+
+    def __init__(self, path, normalize=None, compact_ops=5000, compact_bytes=8 * 1024 * 1024):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self._normalize = normalize
+        self._compact_ops = compact_ops
+        self._compact_bytes = compact_bytes
+        self._lock = threading.RLock()
+        self._live = None
+        self._journal = None
+        self._ops = 0
+        self._compacting = False
+        self._flusher = None
+        self._queue = []
+        self._queue_cond = threading.Condition()
+        self._writer = None
+        # Bumped on every committed batch, so callers can cache things derived from the model
+        self.version = 0
+        self._listeners = []
+        self._logger = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def set_logger(self, logger):
+        self._logger = logger
+
+    def _log(self, msg):
+        try:
+            if self._logger:
+                self._logger(msg)
+        except Exception:
+            pass
+
+    # --- loading ---
+    def _read_snapshot(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+            return json.loads(content) if content else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self._log(f'[Metadata] 读取失败 {self.path}: {e}')
+            return {}
+
+    def _replay(self, live, path):
+        count = 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # Only the last line can be torn by a crash; everything before it is intact
+                        self._log(f'[Metadata] 日志末尾不完整, 已忽略: {path}')
+                        break
+                    self._apply(live, rec.get('s') or [], rec.get('d') or [])
+                    count += 1
+        except FileNotFoundError:
+            pass
+        return count
+
+    def _ensure_loaded(self):
+        if self._live is not None:
+            return
+        with self._lock:
+            if self._live is not None:
+                return
+            t0 = time.time()
+            live, ops = self._load()
+            if self._normalize:
+                live = self._normalize(live)
+            self._live = live
+            self._ops = ops
+            self._log(f'[Metadata] 加载成功: {self.path}, 共 {len(live)} 条记录, 回放日志 {ops} 条, 耗时 {int((time.time() - t0) * 1000)}ms')
+            self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+            self._writer.start()
+            self._start_background()
+
+    def _after_fork(self):
+        # Only the forking thread survives fork: locks a writer held are gone with it, and without a
+        # writer in the child every save would wait forever. Re-create both if the model was loaded.
+        self._lock = threading.RLock()
+        self._queue_cond = threading.Condition()
+        self._queue = []
+        self._compacting = False
+        if self._live is not None:
+            self._reopen()
+            self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+            self._writer.start()
+            self._start_background()
+
+    def _reopen(self):
+        pass
+
+    def _load(self):
+        live = self._read_snapshot()
+        if not isinstance(live, dict):
+            live = {}
+        ops = self._replay(live, self.journal_path + '.1')
+        ops += self._replay(live, self.journal_path)
+        return live, ops
+
+    def _start_background(self):
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    # --- reading / writing ---
+    def snapshot(self):
+        self._ensure_loaded()
+        with self._lock:
+            return MetaSnapshot(dict(self._live))
+
+    def view(self):
+        """Read-only point-in-time view without per-entry copies, for routes that never save.
+
+        The entries are the live model's own objects and must not be modified.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return MappingProxyType(dict(self._live))
+
+    @staticmethod
+    def _apply(live, sets, dels):
+        for path, value in sets:
+            if len(path) == 1:
+                live[path[0]] = value
+            else:
+                container = dict(live.get(path[0]) or {})
+                container[path[1]] = value
+                live[path[0]] = container
+        for path in dels:
+            if len(path) == 1:
+                live.pop(path[0], None)
+            elif isinstance(live.get(path[0]), dict) and path[1] in live[path[0]]:
+                container = dict(live[path[0]])
+                container.pop(path[1], None)
+                live[path[0]] = container
+
+    def commit(self, data):
+        """Persist what changed in ``data`` (a snapshot, or a full replacement dict).
+
+        Returns once the batch holding the change is durable.
+        """
+        self._ensure_loaded()
+        if isinstance(data, MetaSnapshot):
+            sets, dels = data.changes()
+        else:
+            with self._lock:
+                full = MetaSnapshot(dict(self._live))
+            for key in list(dict.keys(full)):
+                if key not in data:
+                    del full[key]
+            for key, value in data.items():
+                full[key] = value
+            sets, dels = full.changes()
+        if not sets and not dels:
+            return True
+        return self._submit(('changes', sets, dels))
+
+    def update(self, fn):
+        """Run ``fn(snapshot)`` on the writer against the latest state and commit its changes.
+
+        Unlike load-modify-commit, read-modify-write of one entry cannot lose
+        a concurrent change to it. ``fn`` runs on the writer thread, so it
+        must be quick and must not save metadata itself. Returns what ``fn``
+        returned once the change is durable.
+        """
+        self._ensure_loaded()
+        return self._submit(('update', fn))
+
+    def add_listener(self, fn):
+        """Call ``fn(records, before, after)`` after each committed batch; ``records`` are ``(sets, dels)`` pairs."""
+        self._listeners.append(fn)
+
+    def _submit(self, op):
+        if threading.current_thread() is self._writer:
+            raise RuntimeError('metadata saved from inside an update')
+        waiter = {'done': threading.Event(), 'result': None, 'error': None}
+        with self._queue_cond:
+            self._queue.append((op, waiter))
+            self._queue_cond.notify()
+        waiter['done'].wait()
+        if waiter['error'] is not None:
+            raise waiter['error']
+        return waiter['result']
+
+    def _writer_loop(self):
+        while True:
+            with self._queue_cond:
+                while not self._queue:
+                    self._queue_cond.wait()
+            # Let the other requests of a burst catch up so they share this write
+            time.sleep(self.BATCH_WINDOW)
+            with self._queue_cond:
+                batch, self._queue = self._queue, []
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        with self._lock:
+            staged = dict(self._live)
+        records = []
+        accepted = []
+        for op, waiter in batch:
+            try:
+                if op[0] == 'update':
+                    snap = MetaSnapshot(dict(staged))
+                    waiter['result'] = op[1](snap)
+                    sets, dels = snap.changes()
+                else:
+                    sets, dels = op[1], op[2]
+                    waiter['result'] = True
+                sets = [[path, _copy_value(value)] for path, value in sets]
+                # _apply only replaces values, so the shallow staging copy never touches the live model
+                self._apply(staged, sets, dels)
+                if sets or dels:
+                    records.append((sets, dels))
+                accepted.append(waiter)
+            except Exception as e:
+                waiter['error'] = e
+        committed = False
+        try:
+            if records:
+                with self._lock:
+                    before = self._live
+                    self._persist(records)
+                    self._live = staged
+                    self._ops += len(records)
+                    self.version += 1
+                committed = True
+                if len(batch) > 1:
+                    self._log(f'[Metadata] 合并提交: {len(batch)} 个请求, 写入 {len(records)} 条变更')
+        except Exception as e:
+            self._log(f'[Metadata] 批量写入失败: {e}')
+            for waiter in accepted:
+                waiter['error'] = e
+        finally:
+            for _, waiter in batch:
+                waiter['done'].set()
+        if committed:
+            # Listeners run on the writer thread, so they see batches in commit order
+            for fn in self._listeners:
+                try:
+                    fn(records, before, staged)
+                except Exception as e:
+                    self._log(f'[Metadata] 通知失败: {e}')
+
+    def _persist(self, records):
+        data = ''.join(json.dumps({'s': sets, 'd': dels}, ensure_ascii=False, separators=(',', ':')) + '\n'
+                       for sets, dels in records)
+        if self._journal is None:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal.write(data)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def peek(self, key):
+        """The live value under ``key``, without copying; it must not be modified."""
+        self._ensure_loaded()
+        return self._live.get(key)
+
+    def count(self):
+        self._ensure_loaded()
+        return len(self._live)
+
+    # --- queries ---
+    def names_in_group(self, group_id):
+        """File names whose entry is in ``group_id``, newest first."""
+        self._ensure_loaded()
+        with self._lock:
+            live = self._live
+            hits = [(k, v.get('mtime') or 0) for k, v in live.items()
+                    if is_file_entry(k, v) and (v.get('group_id') or 'root') == group_id]
+        hits.sort(key=lambda x: x[1], reverse=True)
+        return [k for k, _ in hits]
+
+    def child_groups(self, group_id):
+        self._ensure_loaded()
+        groups = self._live.get('__groups__') or {}
+        return [gid for gid, g in groups.items() if isinstance(g, dict) and g.get('parent_id') == group_id]
+
+    # --- background durability and compaction ---
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.FLUSH_INTERVAL)
+            try:
+                if self._needs_compaction():
+                    self.compact()
+            except Exception as e:
+                self._log(f'[Metadata] 后台合并失败: {e}')
+
+    def _needs_compaction(self):
+        if self._compacting:
+            return False
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            return False
+        return self._ops >= self._compact_ops or size >= self._compact_bytes
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot without blocking writers while it is written."""
+        self._ensure_loaded()
+        with self._lock:
+            if self._compacting:
+                return False
+            self._compacting = True
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+                self._journal = None
+            rotated = self.journal_path + '.1'
+            if os.path.exists(self.journal_path):
+                if os.path.exists(rotated):
+                    # A previous compaction died before finishing: keep both generations in order
+                    with open(rotated, 'a', encoding='utf-8') as dst, open(self.journal_path, 'r', encoding='utf-8') as src:
+                        dst.write(src.read())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, rotated)
+            base = dict(self._live)
+            self._ops = 0
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(base, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            try:
+                os.remove(rotated)
+            except OSError:
+                pass
+            self._log(f'[Metadata] 日志已合并到快照: {self.path}, 共 {len(base)} 条记录')
+            return True
+        except Exception as e:
+            self._log(f'[Metadata] 快照写入失败 {self.path}: {e}')
+            return False
+        finally:
+            self._compacting = False
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+                self._journal = None
+
+
+class SqliteMetadataStore(MetadataStore):
+    """The same model persisted to SQLite (WAL mode) instead of a JSON snapshot and journal.
+
+    Files, groups and texts get their own tables, indexed on group, uploader,
+    mtime and parent group, so group membership is an index lookup. Each
+    entry is also kept whole as JSON, so fields the tables don't model
+    survive unchanged. Other top-level keys go to ``extra``. Every save is
+    one transaction. On first start, an existing ``metadata.json`` and its
+    journal are imported once; ``export_json`` hands the model back when the
+    JSON backend takes over again, and the next switch re-imports.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, group_id TEXT NOT NULL, uploader TEXT, mtime REAL, data TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS files_group ON files (group_id, mtime)',
+        'CREATE INDEX IF NOT EXISTS files_uploader ON files (uploader)',
+        'CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime)',
+        'CREATE TABLE IF NOT EXISTS groups (id TEXT PRIMARY KEY, parent_id TEXT, data TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS groups_parent ON groups (parent_id)',
+        'CREATE TABLE IF NOT EXISTS texts (id TEXT PRIMARY KEY, mtime REAL, data TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS texts_mtime ON texts (mtime)',
+        'CREATE TABLE IF NOT EXISTS extra (key TEXT PRIMARY KEY, data TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS meta_info (key TEXT PRIMARY KEY, value TEXT)',
+    )
+
+    def __init__(self, path, json_path=None, normalize=None):
+        super().__init__(path, normalize=normalize)
+        self.json_path = json_path
+        self._db = None
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        # FULL so a committed batch survives power loss; group commit keeps the syncs few
+        db.execute('PRAGMA synchronous=FULL')
+        for stmt in self.SCHEMA:
+            db.execute(stmt)
+        return db
+
+    @staticmethod
+    def _dumps(value):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+    def _put(self, db, path, value):
+        key = path[0]
+        if len(path) == 2:
+            self._put_record(db, key, path[1], value)
+        elif key in CONTAINER_KEYS and isinstance(value, dict):
+            db.execute(f'DELETE FROM {key.strip("_")}')
+            for rid, rec in value.items():
+                self._put_record(db, key, rid, rec)
+        elif is_file_entry(key, value):
+            db.execute('INSERT OR REPLACE INTO files (name, group_id, uploader, mtime, data) VALUES (?, ?, ?, ?, ?)',
+                       (key, value.get('group_id') or 'root', value.get('uploader'), value.get('mtime'), self._dumps(value)))
+            db.execute('DELETE FROM extra WHERE key = ?', (key,))
+        else:
+            db.execute('INSERT OR REPLACE INTO extra (key, data) VALUES (?, ?)', (key, self._dumps(value)))
+            db.execute('DELETE FROM files WHERE name = ?', (key,))
+
+    def _put_record(self, db, container, rid, rec):
+        rec_dict = rec if isinstance(rec, dict) else {}
+        if container == '__groups__':
+            db.execute('INSERT OR REPLACE INTO groups (id, parent_id, data) VALUES (?, ?, ?)',
+                       (rid, rec_dict.get('parent_id'), self._dumps(rec)))
+        else:
+            db.execute('INSERT OR REPLACE INTO texts (id, mtime, data) VALUES (?, ?, ?)',
+                       (rid, rec_dict.get('mtime'), self._dumps(rec)))
+
+    def _delete(self, db, path):
+        key = path[0]
+        if len(path) == 2:
+            table = key.strip('_')
+            db.execute(f'DELETE FROM {table} WHERE id = ?', (path[1],))
+        elif key in CONTAINER_KEYS:
+            db.execute(f'DELETE FROM {key.strip("_")}')
+            db.execute('DELETE FROM extra WHERE key = ?', (key,))
+        else:
+            db.execute('DELETE FROM files WHERE name = ?', (key,))
+            db.execute('DELETE FROM extra WHERE key = ?', (key,))
+
+    def _write(self, db, records):
+        # One transaction per batch: a single WAL sync covers every request in it
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            for sets, dels in records:
+                for path, value in sets:
+                    self._put(db, path, value)
+                for path in dels:
+                    self._delete(db, path)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def _import_json(self, db):
+        if db.execute("SELECT 1 FROM meta_info WHERE key = 'imported'").fetchone():
+            return 0
+        # Rows left from an earlier SQLite period were handed back to JSON and are stale now
+        for table in ('files', 'groups', 'texts', 'extra'):
+            db.execute(f'DELETE FROM {table}')
+        count = 0
+        if self.json_path and (os.path.exists(self.json_path) or os.path.exists(self.json_path + '.journal')):
+            source = MetadataStore(self.json_path)
+            source.set_logger(self._logger)
+            data, _ = source._load()
+            self._write(db, [([[[k], v] for k, v in data.items()], [])])
+            count = len(data)
+            self._log(f'[Metadata] 已从 {self.json_path} 导入 {count} 条记录到 {self.path}')
+        db.execute("INSERT OR REPLACE INTO meta_info (key, value) VALUES ('imported', ?)", (str(time.time()),))
+        return count
+
+    def _read_all(self, db):
+        live = {}
+        for key, data in db.execute('SELECT key, data FROM extra'):
+            live[key] = json.loads(data)
+        for name, data in db.execute('SELECT name, data FROM files'):
+            live[name] = json.loads(data)
+        for container in CONTAINER_KEYS:
+            table = container.strip('_')
+            records = {rid: json.loads(data) for rid, data in db.execute(f'SELECT id, data FROM {table}')}
+            if records or container in live:
+                live[container] = records
+        return live
+
+    def _load(self):
+        db = self._connect()
+        self._import_json(db)
+        live = self._read_all(db)
+        self._db = db
+        return live, 0
+
+    def export_json(self):
+        """Write the model back to ``json_path`` if this database is still the live copy of it.
+
+        Returns the number of records written, or None when there was nothing
+        to hand back (no database, or it was already exported).
+        """
+        if not self.json_path or not os.path.exists(self.path):
+            return None
+        db = self._connect()
+        try:
+            if not db.execute("SELECT 1 FROM meta_info WHERE key = 'imported'").fetchone():
+                return None
+            live = self._read_all(db)
+            # The journal belongs to the old snapshot; drop it first so a crash can only leave the export to redo
+            for path in (self.json_path + '.journal.1', self.json_path + '.journal'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            tmp = self.json_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(live, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.json_path)
+            db.execute("DELETE FROM meta_info WHERE key = 'imported'")
+            self._log(f'[Metadata] 已从 {self.path} 导出 {len(live)} 条记录到 {self.json_path}')
+            return len(live)
+        finally:
+            db.close()
+
+    def _start_background(self):
+        # SQLite checkpoints the WAL on its own; there is no journal to flush
+        pass
+
+    def _reopen(self):
+        # A connection must not be used across fork. The inherited one is kept unclosed, since closing it
+        # here could checkpoint or drop locks under the parent.
+        if self._db is not None:
+            self._inherited_db = self._db
+            self._db = self._connect()
+
+    def _persist(self, records):
+        self._write(self._db, records)
+
+    def names_in_group(self, group_id):
+        self._ensure_loaded()
+        with self._lock:
+            rows = self._db.execute('SELECT name FROM files WHERE group_id = ? ORDER BY mtime DESC', (group_id,)).fetchall()
+        return [r[0] for r in rows]
+
+    def child_groups(self, group_id):
+        self._ensure_loaded()
+        with self._lock:
+            rows = self._db.execute('SELECT id FROM groups WHERE parent_id = ?', (group_id,)).fetchall()
+        return [r[0] for r in rows]
+
+    def compact(self):
+        self._ensure_loaded()
+        with self._lock:
+            self._db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,93 @@
+import threading
+
+
+def trigrams(text):
+    """Trigrams of ``text`` padded like pg_trgm, so word starts and ends count too."""
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def query_trigrams(q):
+    # Unpadded: a query may match anywhere inside a name, not only at a word boundary
+    return {q[i:i + 3] for i in range(len(q) - 2)}
+
+
+class TrigramIndex:
+    """Incremental trigram index over file names for fuzzy search.
+
+    A name's score for a query is 1.0 when it contains the query, otherwise
+    the share of the query's trigrams found in the name (pg_trgm's word
+    similarity). Like the difflib ratio it replaces it runs from 0 to 1, a
+    typo or a swapped word still scores above 0.5, and long names are not
+    penalised for their length. Only names sharing a trigram with the query
+    are ever looked at.
+    """
+
+    def __init__(self, common_ratio=0.2):
+        self._common_ratio = common_ratio
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._names = {}
+
+    def add(self, name):
+        key = name.lower()
+        with self._lock:
+            if name in self._names:
+                return
+            self._names[name] = key
+            for g in trigrams(key):
+                self._postings.setdefault(g, set()).add(name)
+
+    def remove(self, name):
+        with self._lock:
+            key = self._names.pop(name, None)
+            if key is None:
+                return
+            for g in trigrams(key):
+                posting = self._postings.get(g)
+                if posting is not None:
+                    posting.discard(name)
+                    if not posting:
+                        del self._postings[g]
+
+    def update(self, added=(), removed=()):
+        for name in removed:
+            self.remove(name)
+        for name in added:
+            self.add(name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def search(self, q, threshold=0.5):
+        """Return ``{name: score}`` for names scoring at least ``threshold`` against ``q``."""
+        q = q.lower()
+        if not q:
+            return {}
+        with self._lock:
+            if len(q) < 3:
+                # Too short for trigrams; a substring test per name is cheap
+                return {n: 1.0 for n, key in self._names.items() if q in key}
+            grams = query_trigrams(q)
+            need = threshold * len(grams)
+            # Trigrams in a large share of names (".jp", "jpg") are checked per candidate instead of
+            # walking their postings, unless they alone could reach the threshold
+            common_limit = max(1, int(len(self._names) * self._common_ratio))
+            rare = [g for g in grams if len(self._postings.get(g, ())) <= common_limit]
+            common = [g for g in grams if g not in rare]
+            if len(common) >= need:
+                rare, common = list(grams), []
+            counts = {}
+            for g in rare:
+                for n in self._postings.get(g, ()):
+                    counts[n] = counts.get(n, 0) + 1
+            results = {}
+            for n, hits in counts.items():
+                key = self._names[n]
+                if q in key:
+                    results[n] = 1.0
+                    continue
+                hits += sum(1 for g in common if g in key)
+                if hits >= need:
+                    results[n] = hits / len(grams)
+        return results
@@ -2870,9 +2870,51 @@ const App = () => {
 
     const load = () => { fetchFiles(); fetchTexts(); fetchGroups(); };
     load();
-    const interval = setInterval(load, 5000);
+    // Follow the server's change feed instead of re-fetching every list every few seconds;
+    // fall back to polling where EventSource is missing or keeps failing
+    let interval: ReturnType<typeof setInterval> | null = null;
+    let source: EventSource | null = null;
+    const pending = { files: false, texts: false, groups: false };
+    let flushTimer: ReturnType<typeof setTimeout> | null = null;
+    const schedule = (what: Partial<typeof pending>) => {
+      Object.assign(pending, what);
+      if (flushTimer) return;
+      // Coalesce bursts (e.g. a multi-file upload) into one fetch per list
+      flushTimer = setTimeout(() => {
+        flushTimer = null;
+        if (pending.files) fetchFiles();
+        if (pending.texts) fetchTexts();
+        if (pending.groups) fetchGroups();
+        pending.files = pending.texts = pending.groups = false;
+      }, 300);
+    };
+    const startPolling = () => {
+      if (!interval) interval = setInterval(load, 5000);
+    };
+    if (typeof EventSource !== 'undefined') {
+      let failures = 0;
+      source = new EventSource('/api/events');
+      source.addEventListener('open', () => { failures = 0; });
+      source.addEventListener('file', () => schedule({ files: true }));
+      source.addEventListener('text', () => schedule({ texts: true }));
+      // Hiding or moving a group changes which files are visible
+      source.addEventListener('group', () => schedule({ groups: true, files: true }));
+      source.addEventListener('reset', () => schedule({ files: true, texts: true, groups: true }));
+      source.onerror = () => {
+        failures += 1;
+        if (failures >= 5 && source) {
+          source.close();
+          source = null;
+          startPolling();
+        }
+      };
+    } else {
+      startPolling();
+    }
     return () => {
-      clearInterval(interval);
+      if (interval) clearInterval(interval);
+      if (flushTimer) clearTimeout(flushTimer);
+      if (source) source.close();
       try {
         window.removeEventListener('error', onWinError);
         window.removeEventListener('unhandledrejection', onRejection as any);
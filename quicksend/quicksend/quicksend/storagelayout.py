@@ -0,0 +1,276 @@
+import hashlib
+import os
+import threading
+import time
+
+LAYOUTS = ('flat', 'sharded')
+
+
+class StorageLayout:
+    """Maps the user-visible (flat) file names to where the files are stored.
+
+    ``flat`` keeps every file directly in the upload folder. ``sharded``
+    stores ``name`` as ``<root>/<shard_dir>/<aa>/name``, where ``aa`` are
+    the first two hex digits of the SHA-1 of the name, so each directory
+    holds about 1/256 of the share and a create or lookup only touches a
+    small one. The path follows from the name alone, so nothing extra is
+    kept in metadata. A scan lists only the shards whose mtime changed
+    since their last listing; ``invalidate`` drops a shard's listing after
+    a file in it was changed in place, which does not move the mtime.
+
+    Files found in the other layout (an existing flat folder after switching
+    to ``sharded``, or back) are still served from where they are and are
+    moved over by ``migrate`` in the background.
+    """
+
+    def __init__(self, root_getter, layout='flat', shard_dir=os.path.join('.quicksend', 'files'), skip=None, settle_seconds=60):
+        self._root_getter = root_getter
+        self.layout = layout if layout in LAYOUTS else 'flat'
+        self._shard_dir = shard_dir
+        self._skip = skip
+        self._settle = settle_seconds
+        self._migrating = False
+        self._moved = 0
+        self._conflicts = 0
+        self._migration = None
+        self._migration_thread = None
+        self._shard_cache = {}
+        self._cache_lock = threading.Lock()
+        self._logger = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def set_logger(self, logger):
+        self._logger = logger
+
+    def _log(self, msg):
+        try:
+            if self._logger:
+                self._logger(msg)
+        except Exception:
+            pass
+
+    @property
+    def sharded(self):
+        return self.layout == 'sharded'
+
+    @staticmethod
+    def valid_name(name):
+        return bool(name) and name not in ('.', '..') and '/' not in name and '\\' not in name and '\0' not in name
+
+    # --- paths ---
+    def shard_root(self, root=None):
+        return os.path.join(root or self._root_getter(), self._shard_dir)
+
+    def _shard_path(self, root, name):
+        h = hashlib.sha1(name.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(root, self._shard_dir, h[:2], name)
+
+    def _paths(self, name):
+        """``(preferred, other)``: where ``name`` belongs under this layout, and where it may still be."""
+        root = self._root_getter()
+        flat = os.path.join(root, name)
+        shard = self._shard_path(root, name)
+        return (shard, flat) if self.sharded else (flat, shard)
+
+    def target(self, name):
+        """Path for a new file called ``name`` (its directory is created), or None for an invalid name."""
+        if not self.valid_name(name):
+            return None
+        path = self._paths(name)[0]
+        if self.sharded:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def path(self, name):
+        """Where ``name`` is stored now; the preferred path when it does not exist (None for an invalid name)."""
+        if not self.valid_name(name):
+            return None
+        preferred, other = self._paths(name)
+        if os.path.lexists(preferred):
+            return preferred
+        if os.path.lexists(other):
+            return other
+        # It may have been moved between the two checks
+        return preferred
+
+    def exists(self, name):
+        if not self.valid_name(name):
+            return False
+        return any(os.path.lexists(p) for p in self._paths(name))
+
+    # --- scanning ---
+    def scan(self, root):
+        """``{name: stat_result}`` for every file under ``root`` in either layout; raises OSError if ``root`` is unreadable."""
+        entries = {}
+        shards = {}
+        with os.scandir(root) as it:
+            for de in it:
+                try:
+                    if de.is_file():
+                        entries[de.name] = de.stat()
+                except OSError:
+                    continue
+        for name, st in self._iter_shards(root):
+            shards[name] = st
+        if self.sharded:
+            entries.update(shards)
+        else:
+            for name, st in shards.items():
+                entries.setdefault(name, st)
+        return entries
+
+    def _iter_shards(self, root):
+        base = os.path.join(root, self._shard_dir)
+        try:
+            shards = [de.path for de in os.scandir(base) if de.is_dir()]
+        except OSError:
+            return
+        with self._cache_lock:
+            for d in [d for d in self._shard_cache if os.path.dirname(d) == base and d not in shards]:
+                del self._shard_cache[d]
+        for d in shards:
+            for name, st in self._shard_listing(root, d):
+                yield name, st
+
+    # Listings of a shard changed this recently are not reused: some filesystems keep mtimes in 2 s steps
+    _CACHE_SETTLE = 2.0
+
+    def _shard_listing(self, root, shard):
+        try:
+            mtime = os.stat(shard).st_mtime_ns
+        except OSError:
+            return []
+        with self._cache_lock:
+            hit = self._shard_cache.get(shard)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+        entries = []
+        try:
+            with os.scandir(shard) as it:
+                for de in it:
+                    try:
+                        # Misplaced files would never be found by name, so they are not listed either
+                        if de.is_file() and self._shard_path(root, de.name) == de.path:
+                            entries.append((de.name, de.stat()))
+                    except OSError:
+                        continue
+        except OSError:
+            return []
+        with self._cache_lock:
+            if time.time() - mtime / 1e9 > self._CACHE_SETTLE:
+                self._shard_cache[shard] = (mtime, entries)
+            else:
+                self._shard_cache.pop(shard, None)
+        return entries
+
+    def invalidate(self, name):
+        if not self.valid_name(name):
+            return
+        shard = os.path.dirname(self._shard_path(self._root_getter(), name))
+        with self._cache_lock:
+            self._shard_cache.pop(shard, None)
+
+    # --- migration ---
+    def _misplaced(self, root):
+        if self.sharded:
+            try:
+                with os.scandir(root) as it:
+                    for de in it:
+                        try:
+                            if de.is_file():
+                                yield de.name, de.path, de.stat()
+                        except OSError:
+                            continue
+            except OSError:
+                return
+        else:
+            for name, st in self._iter_shards(root):
+                yield name, self._shard_path(root, name), st
+
+    def migrate(self, on_moved=None, batch=500, pause=0.05):
+        """Move files stored under the other layout to where this layout puts them.
+
+        Runs online: each file is moved with one rename, lookups find it at
+        either path meanwhile, and ``on_moved(name)`` is called after each
+        move. Files changed in the last ``settle_seconds`` are left for a
+        later pass since something may still be writing them. Returns the
+        number of files moved.
+        """
+        root = self._root_getter()
+        moved = 0
+        self._migrating = True
+        t0 = time.time()
+        try:
+            for name, src, st in list(self._misplaced(root)):
+                if self._skip and self._skip(name):
+                    continue
+                if self._settle and time.time() - st.st_mtime < self._settle:
+                    continue
+                dst = self._paths(name)[0]
+                try:
+                    if os.path.lexists(dst):
+                        self._conflicts += 1
+                        self._log(f'[存储] 迁移跳过, 目标已存在: {name}')
+                        continue
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    os.replace(src, dst)
+                except OSError as e:
+                    self._log(f'[存储] 迁移失败: {name}: {e}')
+                    continue
+                moved += 1
+                self._moved += 1
+                if on_moved:
+                    try:
+                        on_moved(name)
+                    except Exception as e:
+                        self._log(f'[存储] 迁移回调失败: {name}: {e}')
+                if moved % batch == 0:
+                    self._log(f'[存储] 迁移进行中: 已移动 {moved} 个文件')
+                    time.sleep(pause)
+            if not self.sharded:
+                self._prune_shards(root)
+        finally:
+            self._migrating = False
+        if moved:
+            self._log(f'[存储] 迁移完成 ({self.layout}): 移动 {moved} 个文件, 耗时 {int((time.time() - t0) * 1000)}ms')
+        return moved
+
+    def _prune_shards(self, root):
+        # After switching back to flat, drop the shard directories that were emptied; rmdir leaves the rest alone
+        base = os.path.join(root, self._shard_dir)
+        for dirpath, _, _ in list(os.walk(base, topdown=False)):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+
+    def _after_fork(self):
+        # The migration thread does not survive fork; restart it in the child if it was running
+        self._cache_lock = threading.Lock()
+        self._migrating = False
+        self._migration_thread = None
+        if self._migration is not None:
+            self.start_migration(*self._migration)
+
+    def start_migration(self, on_moved=None, interval=300):
+        """Migrate now and then every ``interval`` seconds, so files copied straight into the folder move too."""
+        if self._migration_thread is not None and self._migration_thread.is_alive():
+            return self._migration_thread
+        self._migration = (on_moved, interval)
+
+        def _loop():
+            while True:
+                try:
+                    self.migrate(on_moved)
+                except Exception as e:
+                    self._log(f'[存储] 迁移失败: {e}')
+                if not interval:
+                    return
+                time.sleep(interval)
+        self._migration_thread = threading.Thread(target=_loop, daemon=True)
+        self._migration_thread.start()
+        return self._migration_thread
+
+    def stats(self):
+        return {'layout': self.layout, 'migrating': self._migrating, 'moved': self._moved, 'conflicts': self._conflicts}
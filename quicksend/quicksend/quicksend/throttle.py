@@ -0,0 +1,203 @@
+import threading
+import time
+import uuid
+
+
+class TransferScheduler:
+    """Shapes upload and download throughput per client and across the host.
+
+    ``settings_getter`` returns a dict with ``global_rate`` and ``client_rate``
+    (bytes per second, 0 for unlimited), ``max_per_client`` (concurrent
+    transfers, 0 for unlimited) and ``weights`` (client -> weight).
+
+    The global rate is split between the clients that currently have a
+    transfer open, in proportion to their weights, and each share is capped
+    by the per-client rate. Every client has its own token bucket, so a
+    client running one 40 GB download and a client fetching a small file get
+    the same share instead of one connection crowding out the other. Several
+    transfers from one client draw from that client's bucket.
+    """
+
+    BURST_SECONDS = 0.5
+
+    def __init__(self, settings_getter):
+        self._settings_getter = settings_getter
+        self._lock = threading.Lock()
+        self._transfers = {}
+        self._buckets = {}
+        self._logger = None
+
+    def set_logger(self, logger):
+        self._logger = logger
+
+    def _log(self, msg):
+        try:
+            if self._logger:
+                self._logger(msg)
+        except Exception:
+            pass
+
+    def _settings(self):
+        try:
+            s = self._settings_getter() or {}
+        except Exception:
+            s = {}
+        return {
+            'global_rate': max(0, int(s.get('global_rate') or 0)),
+            'client_rate': max(0, int(s.get('client_rate') or 0)),
+            'max_per_client': max(0, int(s.get('max_per_client') or 0)),
+            'weights': s.get('weights') or {},
+        }
+
+    def _weight(self, settings, client):
+        try:
+            return max(0.01, float(settings['weights'].get(client, 1)))
+        except Exception:
+            return 1.0
+
+    def enabled(self):
+        s = self._settings()
+        return bool(s['global_rate'] or s['client_rate'] or s['max_per_client'])
+
+    def open(self, client, kind, name=''):
+        """Register a transfer; returns None when the client is at its concurrency limit."""
+        limit = self._settings()['max_per_client']
+        with self._lock:
+            if limit and sum(1 for t in self._transfers.values() if t['client'] == client) >= limit:
+                return None
+            transfer = {
+                'id': uuid.uuid4().hex,
+                'client': client,
+                'kind': kind,
+                'name': name,
+                'started': time.time(),
+                'bytes': 0,
+            }
+            self._transfers[transfer['id']] = transfer
+            return transfer
+
+    def close(self, transfer):
+        if not transfer:
+            return
+        with self._lock:
+            self._transfers.pop(transfer['id'], None)
+            client = transfer['client']
+            if not any(t['client'] == client for t in self._transfers.values()):
+                self._buckets.pop(client, None)
+
+    def _client_rate(self, settings, client):
+        rate = settings['client_rate']
+        if settings['global_rate']:
+            active = {t['client'] for t in self._transfers.values()}
+            active.add(client)
+            total = sum(self._weight(settings, c) for c in active)
+            share = settings['global_rate'] * self._weight(settings, client) / total
+            rate = min(rate, share) if rate else share
+        return rate
+
+    def consume(self, transfer, nbytes):
+        """Account ``nbytes`` for ``transfer``, sleeping as long as its client's rate requires."""
+        if not transfer or nbytes <= 0:
+            return
+        settings = self._settings()
+        with self._lock:
+            transfer['bytes'] += nbytes
+            rate = self._client_rate(settings, transfer['client'])
+            if not rate:
+                return
+            now = time.monotonic()
+            bucket = self._buckets.get(transfer['client'])
+            if bucket is None:
+                bucket = {'tokens': rate * self.BURST_SECONDS, 'ts': now}
+                self._buckets[transfer['client']] = bucket
+            bucket['tokens'] = min(rate * self.BURST_SECONDS, bucket['tokens'] + (now - bucket['ts']) * rate)
+            bucket['ts'] = now
+            # Going into debt and sleeping it off keeps large chunks smooth without splitting them
+            bucket['tokens'] -= nbytes
+            wait = -bucket['tokens'] / rate if bucket['tokens'] < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def wrap_iter(self, transfer, iterable):
+        """Throttle a response body; the transfer is closed when the server closes the body."""
+        return _ThrottledBody(self, transfer, iterable)
+
+    def wrap_reader(self, transfer, stream):
+        return _ThrottledReader(self, transfer, stream)
+
+    def stats(self):
+        settings = self._settings()
+        now = time.time()
+        with self._lock:
+            items = []
+            for t in self._transfers.values():
+                elapsed = max(0.001, now - t['started'])
+                items.append({
+                    'id': t['id'],
+                    'client': t['client'],
+                    'kind': t['kind'],
+                    'name': t['name'],
+                    'bytes': t['bytes'],
+                    'rate': int(t['bytes'] / elapsed),
+                    'limit': int(self._client_rate(settings, t['client'])),
+                })
+        return {
+            'global_rate': settings['global_rate'],
+            'client_rate': settings['client_rate'],
+            'max_per_client': settings['max_per_client'],
+            'transfers': items,
+        }
+
+
+class _ThrottledBody:
+    # A class rather than a generator: close() must release the transfer even if iteration never started
+    def __init__(self, scheduler, transfer, iterable):
+        self._scheduler = scheduler
+        self._transfer = transfer
+        self._iterable = iterable
+
+    def __iter__(self):
+        for chunk in self._iterable:
+            self._scheduler.consume(self._transfer, len(chunk))
+            yield chunk
+
+    def close(self):
+        transfer, self._transfer = self._transfer, None
+        if transfer is None:
+            return
+        close = getattr(self._iterable, 'close', None)
+        if close:
+            try:
+                close()
+            except Exception:
+                pass
+        self._scheduler.close(transfer)
+
+
+class _ThrottledReader:
+    def __init__(self, scheduler, transfer, stream):
+        self._scheduler = scheduler
+        self._transfer = transfer
+        self._stream = stream
+
+    def read(self, size=-1):
+        buf = self._stream.read(size)
+        if buf:
+            self._scheduler.consume(self._transfer, len(buf))
+        return buf
+
+    def readline(self, size=-1):
+        buf = self._stream.readline(size)
+        if buf:
+            self._scheduler.consume(self._transfer, len(buf))
+        return buf
+
+    def readinto(self, b):
+        # Werkzeug's LimitedStream prefers readinto; without this it would bypass the throttle via __getattr__
+        n = self._stream.readinto(b)
+        if n:
+            self._scheduler.consume(self._transfer, n)
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from ingest import CorruptEncodingError, DecompressionLimitError, preallocate
+
+
+class UploadSessionError(Exception):
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.extra = extra
+
+
+def _merge_range(ranges, start, end):
+    out = []
+    for a, b in sorted(ranges + [[start, end]]):
+        if out and a <= out[-1][1]:
+            out[-1][1] = max(out[-1][1], b)
+        else:
+            out.append([a, b])
+    return out
+
+
+def _pwrite(fd, data, offset):
+    if hasattr(os, 'pwrite'):
+        while data:
+            n = os.pwrite(fd, data, offset)
+            data = data[n:]
+            offset += n
+        return
+    # No pwrite on Windows; every connection has its own descriptor, so its cursor is private
+    os.lseek(fd, offset, os.SEEK_SET)
+    while data:
+        n = os.write(fd, data)
+        data = data[n:]
+
+
+class UploadSessionStore:
+    """Resumable upload sessions kept next to the upload folder.
+
+    Each session is a ``<id>.part`` data file plus a ``<id>.json`` state file
+    under ``<upload_folder>/.quicksend/sessions``, so finalizing is a rename on
+    the same volume and sessions survive restarts.
+
+    Sequential sessions only accept the chunk at the committed offset, and
+    hash it as it is written. Parallel sessions preallocate the file and
+    accept byte ranges in any order from any number of connections, tracking
+    which ranges have landed; their hash is computed when they are finalized.
+    """
+
+    CHUNK_READ_SIZE = 1024 * 1024
+
+    def __init__(self, root_getter, ttl_seconds=7 * 24 * 3600):
+        self._root_getter = root_getter
+        self._ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._session_locks = {}
+        self._hashers = {}
+        self._logger = None
+
+    def set_logger(self, logger):
+        self._logger = logger
+
+    def _log(self, msg):
+        try:
+            if self._logger:
+                self._logger(msg)
+        except Exception:
+            pass
+
+    def _dir(self):
+        d = os.path.join(self._root_getter(), 'sessions')
+        os.makedirs(d, exist_ok=True)
+        return d
+
+    def _state_path(self, sid):
+        return os.path.join(self._dir(), f'{sid}.json')
+
+    def part_path(self, sid):
+        return os.path.join(self._dir(), f'{sid}.part')
+
+    def _session_lock(self, sid):
+        with self._lock:
+            lk = self._session_locks.get(sid)
+            if lk is None:
+                lk = threading.Lock()
+                self._session_locks[sid] = lk
+            return lk
+
+    def _valid_id(self, sid):
+        return bool(sid) and len(sid) == 32 and all(c in '0123456789abcdef' for c in sid)
+
+    def _write_state(self, state):
+        p = self._state_path(state['id'])
+        tmp = p + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, p)
+
+    def _read_state(self, sid):
+        if not self._valid_id(sid):
+            return None
+        try:
+            with open(self._state_path(sid), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def create(self, filename, size, uploader='', password_hash=None, group_id='root', parallel=False):
+        self.sweep()
+        sid = uuid.uuid4().hex
+        now = time.time()
+        state = {
+            'id': sid,
+            'filename': filename,
+            'size': int(size),
+            'offset': 0,
+            'uploader': uploader,
+            'password_hash': password_hash,
+            'group_id': group_id,
+            'parallel': bool(parallel),
+            'ranges': [],
+            'created': now,
+            'updated': now,
+        }
+        with open(self.part_path(sid), 'wb') as f:
+            # Preallocated space has already left the volume's free space, so it is not pending any more
+            state['preallocated'] = bool(preallocate(f.fileno(), state['size']))
+            if parallel:
+                f.truncate(state['size'])
+        self._write_state(state)
+        self._log(f'[分片上传] 创建会话: {sid}, 文件: {filename}, 大小: {size}')
+        return state
+
+    def get(self, sid):
+        state = self._read_state(sid)
+        if not state:
+            return None
+        try:
+            actual = os.path.getsize(self.part_path(sid))
+        except OSError:
+            return None
+        if state.get('parallel'):
+            ranges = state.get('ranges') or []
+            state['offset'] = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        elif actual < state.get('offset', 0):
+            # The data file is the source of truth if a crash hit between the write and the state update
+            state['offset'] = actual
+        return state
+
+    def missing_ranges(self, state, limit=100):
+        if not state.get('parallel'):
+            return [[state['offset'], state['size']]] if state['offset'] < state['size'] else []
+        out = []
+        pos = 0
+        for a, b in (state.get('ranges') or []):
+            if a > pos:
+                out.append([pos, a])
+            pos = max(pos, b)
+        if pos < state['size']:
+            out.append([pos, state['size']])
+        return out[:limit]
+
+    def write_chunk(self, sid, offset, stream, end=None):
+        with self._session_lock(sid):
+            state = self.get(sid)
+            if not state:
+                raise UploadSessionError('not found', 404)
+            if not state.get('parallel'):
+                return self._write_sequential(sid, state, offset, stream)
+        return self._write_range(sid, state, offset, stream, end)
+
+    def _write_sequential(self, sid, state, offset, stream):
+        if offset != state['offset']:
+            raise UploadSessionError('offset mismatch', 409, offset=state['offset'])
+        remaining = state['size'] - offset
+        written = 0
+        err = None
+        # Running hash of the committed prefix; lost on restart, in which case finalize re-reads the file
+        hashed = self._hashers.get(sid)
+        if offset == 0:
+            hashed = (0, hashlib.sha256())
+        elif hashed is not None and hashed[0] != offset:
+            hashed = None
+        with open(self.part_path(sid), 'r+b') as f:
+            f.seek(offset)
+            if os.fstat(f.fileno()).st_size > offset:
+                # Only cut off an unacknowledged tail; an unconditional truncate would also free the preallocation
+                f.truncate()
+            try:
+                while True:
+                    buf = stream.read(self.CHUNK_READ_SIZE)
+                    if not buf:
+                        break
+                    if written + len(buf) > remaining:
+                        err = UploadSessionError('chunk exceeds declared size', 413, offset=offset + written)
+                        break
+                    f.write(buf)
+                    written += len(buf)
+                    if hashed is not None:
+                        hashed[1].update(buf)
+            except (CorruptEncodingError, DecompressionLimitError) as e:
+                # A bad or oversized compressed chunk is the client's error (400/413), not a dropped connection
+                err = UploadSessionError(e.description, e.code, offset=offset + written)
+            except Exception as e:
+                # Client went away mid-chunk: keep whatever reached the disk so it can resume from there
+                self._log(f'[分片上传] 连接中断: {sid}, 已写入 {written} 字节: {e}')
+            f.flush()
+            os.fsync(f.fileno())
+        if hashed is not None:
+            self._hashers[sid] = (offset + written, hashed[1])
+        else:
+            self._hashers.pop(sid, None)
+        state['offset'] = offset + written
+        state['updated'] = time.time()
+        self._write_state(state)
+        if err is not None:
+            raise err
+        return state
+
+    def _write_range(self, sid, state, start, stream, end=None):
+        size = state['size']
+        limit = size if end is None else end
+        if start < 0 or start > size or limit > size or limit < start:
+            raise UploadSessionError('range out of bounds', 416)
+        pos = start
+        err = None
+        fd = os.open(self.part_path(sid), os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            try:
+                while True:
+                    buf = stream.read(self.CHUNK_READ_SIZE)
+                    if not buf:
+                        break
+                    if pos + len(buf) > limit:
+                        err = UploadSessionError('chunk exceeds declared range', 413)
+                        break
+                    _pwrite(fd, buf, pos)
+                    pos += len(buf)
+            except (CorruptEncodingError, DecompressionLimitError) as e:
+                err = UploadSessionError(e.description, e.code)
+            except Exception as e:
+                self._log(f'[分片上传] 连接中断: {sid}, 区间 {start}-{pos}: {e}')
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        with self._session_lock(sid):
+            state = self.get(sid)
+            if not state:
+                raise UploadSessionError('not found', 404)
+            if pos > start:
+                state['ranges'] = _merge_range(state.get('ranges') or [], start, pos)
+                state['updated'] = time.time()
+                self._write_state(state)
+                state = self.get(sid)
+            if err is not None:
+                err.extra['offset'] = state['offset']
+                raise err
+            return state
+
+    def finalize(self, sid, commit):
+        """Hand a fully received session to ``commit(state, part_path)``.
+
+        ``commit`` is expected to move the data file into place; the session
+        is only dropped once it returns, so a failed commit can be retried.
+        """
+        with self._session_lock(sid):
+            state = self.get(sid)
+            if not state:
+                raise UploadSessionError('not found', 404)
+            if self.missing_ranges(state, limit=1):
+                raise UploadSessionError('upload incomplete', 409, offset=state['offset'])
+            hashed = self._hashers.get(sid)
+            if hashed is not None and hashed[0] == state['size']:
+                state['sha256'] = hashed[1].hexdigest()
+            result = commit(state, self.part_path(sid))
+            self._hashers.pop(sid, None)
+            for p in (self.part_path(sid), self._state_path(sid)):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+        with self._lock:
+            self._session_locks.pop(sid, None)
+        return result
+
+    def discard(self, sid):
+        if not self._valid_id(sid):
+            return False
+        with self._session_lock(sid):
+            self._hashers.pop(sid, None)
+            found = False
+            for p in (self.part_path(sid), self._state_path(sid)):
+                try:
+                    os.remove(p)
+                    found = True
+                except OSError:
+                    pass
+        with self._lock:
+            self._session_locks.pop(sid, None)
+        return found
+
+    def pending_bytes(self):
+        """Bytes still expected by open sessions, so admission control can hold space for them."""
+        total = 0
+        try:
+            d = self._dir()
+            for name in os.listdir(d):
+                if not name.endswith('.json'):
+                    continue
+                state = self._read_state(name[:-5])
+                if not state or state.get('preallocated'):
+                    continue
+                if state.get('parallel'):
+                    received = sum(b - a for a, b in (state.get('ranges') or []))
+                else:
+                    received = state.get('offset', 0)
+                total += max(0, state.get('size', 0) - received)
+        except Exception:
+            pass
+        return total
+
+    def sweep(self):
+        try:
+            d = self._dir()
+            cutoff = time.time() - self._ttl
+            for name in os.listdir(d):
+                if not name.endswith('.json'):
+                    continue
+                sid = name[:-5]
+                state = self._read_state(sid)
+                if state is None or (state.get('updated') or 0) < cutoff:
+                    self.discard(sid)
+                    self._log(f'[分片上传] 清理过期会话: {sid}')
+        except Exception:
+            pass